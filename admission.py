@@ -0,0 +1,112 @@
+import os
+import asyncio
+import threading
+
+# --- Admission control settings (override via environment variables) ---
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "32"))  # Questions in the pipeline at once per worker
+QUERY_MAX_QUEUE = int(os.getenv("QUERY_MAX_QUEUE", "64"))              # Questions allowed to wait for a slot; beyond that, 503
+# The async queue (asgi.py) has its own limits: a question waiting on OpenAI costs it a coroutine, not
+# a thread, so it can hold as many as the OpenAI connection pool and blocking pool can serve at
+# once (OPENAI_MAX_CONNECTIONS + ASYNC_BLOCKING_POOL_SIZE by default; see gunicorn.conf.py)
+ASYNC_QUERY_MAX_CONCURRENCY = int(os.getenv("ASYNC_QUERY_MAX_CONCURRENCY", "96"))
+ASYNC_QUERY_MAX_QUEUE = int(os.getenv("ASYNC_QUERY_MAX_QUEUE", "384"))
+QUERY_QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUERY_QUEUE_TIMEOUT_SECONDS", "5"))
+QUERY_RETRY_AFTER_SECONDS = os.getenv("QUERY_RETRY_AFTER_SECONDS", "2") # Retry-After header on rejected requests
+
+_queues = [] # Every queue created in this process, for the metrics collector
+
+
+def all_queues():
+    return list(_queues)
+
+
+class _Admission:
+    """Limits and counters shared by the thread and event-loop admission queues."""
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        _queues.append(self)
+
+    def _enqueue(self):
+        """Counts a new arrival as waiting; False (rejected) if every slot is busy and the queue is full."""
+        with self._lock:
+            if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            return True
+
+    def _dequeue(self, admitted):
+        with self._lock:
+            self.waiting -= 1
+            if admitted:
+                self.active += 1
+                self.admitted += 1
+            else:
+                self.rejected += 1
+
+    def _released(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"active": self.active, "waiting": self.waiting, "admitted": self.admitted,
+                    "rejected": self.rejected, "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+
+
+class AdmissionQueue(_Admission):
+    """
+    Bounds the questions a worker works on at once. Up to `max_concurrency` hold a slot;
+    up to `max_queue` more wait for one (at most `queue_timeout` seconds); anything beyond
+    is rejected at once, so overload turns into fast 503s instead of a growing backlog.
+    """
+
+    def __init__(self, name="sync", max_concurrency=QUERY_MAX_CONCURRENCY, max_queue=QUERY_MAX_QUEUE,
+                 queue_timeout=QUERY_QUEUE_TIMEOUT_SECONDS):
+        super().__init__(name, max_concurrency, max_queue, queue_timeout)
+        self._slots = threading.Semaphore(self.max_concurrency)
+
+    def acquire(self):
+        """True once a slot is held (pair with release()); False if rejected or the wait timed out."""
+        if not self._enqueue():
+            return False
+        admitted = self._slots.acquire(timeout=self.queue_timeout)
+        self._dequeue(admitted)
+        return admitted
+
+    def release(self):
+        self._released()
+        self._slots.release()
+
+
+class AsyncAdmissionQueue(_Admission):
+    """Event-loop counterpart of AdmissionQueue for asgi.py; waiting never blocks the loop."""
+
+    def __init__(self, name="async", max_concurrency=ASYNC_QUERY_MAX_CONCURRENCY, max_queue=ASYNC_QUERY_MAX_QUEUE,
+                 queue_timeout=QUERY_QUEUE_TIMEOUT_SECONDS):
+        super().__init__(name, max_concurrency, max_queue, queue_timeout)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def acquire(self):
+        if not self._enqueue():
+            return False
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            admitted = True
+        except asyncio.TimeoutError:
+            admitted = False
+        self._dequeue(admitted)
+        return admitted
+
+    async def release(self):
+        self._released()
+        self._slots.release()
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+# --- Semantic answer cache settings (override via environment variables) ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Cosine similarity a cached question needs to be reused. A cached answer is served without
+# retrieval or GPT-4o, so the bar is no lower than the direct-answer gate's (app.DIRECT_ANSWER_MAX_DISTANCE,
+# cosine 0.985): ada-002 puts questions that differ in one meaningful word above 0.95 (seed FAQs
+# "...by employers" and "...by employees" among them), so 0.97 could answer one with the other.
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.985"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of generated answers, looked up by cosine similarity between the
+    new question's embedding and previously answered questions. Entries expire after
+    `ttl_seconds`, the least recently used entry is evicted when full, and the whole
+    cache is dropped whenever the FAQ collection version changes.
+    """
+
+    def __init__(self, similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._vectors = None    # (max_entries, dim) float32 matrix of unit vectors, allocated on first store
+        self._entries = []      # Row-aligned dicts: question, answer, created_at, last_used
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # --- Helpers below expect the caller to hold self._lock ---
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries = []
+            self._version = version
+
+    def _remove_row(self, row):
+        """Removes a row by moving the last row into its slot."""
+        last = len(self._entries) - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._entries[row] = self._entries[last]
+        self._entries.pop()
+
+    def _expire(self, now):
+        row = 0
+        while row < len(self._entries):
+            if now - self._entries[row]["created_at"] > self.ttl_seconds:
+                self._remove_row(row)
+            else:
+                row += 1
+
+    def lookup(self, embedding, version=None):
+        """
+        Returns {"question", "answer", "similarity"} for the closest cached question whose
+        similarity is at or above the threshold, otherwise None.
+        """
+        query = self._unit(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            self._expire(now)
+            if not self._entries or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = self._vectors[:len(self._entries)] @ query
+            best_row = int(np.argmax(similarities))
+            best_similarity = float(similarities[best_row])
+            if best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[best_row]
+            entry["last_used"] = now
+            self.hits += 1
+            return {"question": entry["question"], "answer": entry["answer"], "similarity": best_similarity}
+
+    def store(self, question, embedding, answer, version=None):
+        """Caches `answer` for `question`, evicting the least recently used entry when full."""
+        vector = self._unit(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._entries = []
+
+            if len(self._entries) >= self.max_entries:
+                self._expire(now)
+            if len(self._entries) >= self.max_entries:
+                lru_row = min(range(len(self._entries)), key=lambda r: self._entries[r]["last_used"])
+                self._remove_row(lru_row)
+                self.evictions += 1
+
+            row = len(self._entries)
+            self._vectors[row] = vector
+            self._entries.append({"question": question, "answer": answer, "created_at": now, "last_used": now})
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+            }
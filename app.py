@@ -1,22 +1,59 @@
 import os
+import time
+import logging
+import threading
 import json # For handling JSON request data
-import chromadb
-from openai import OpenAI
+import openai
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from flask import Flask, jsonify, Blueprint, render_template, request
+from flask import Flask, jsonify, Blueprint, render_template, request, Response, stream_with_context, after_this_request
 
-# Load environment variables (especially OPENAI_API_KEY)
+# Load environment variables (especially OPENAI_API_KEY) before importing project modules,
+# which read their settings from the environment at import time
 load_dotenv()
 
+from ingestion import (
+    prepare_faq_records, ingest_records, sync_records, get_collection_version,
+    load_faq_file, file_sha256, seed_lock, SEED_HASH_KEY
+)
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_PATH
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from retrievers import create_retriever, RETRIEVER_BACKEND
+from lexical_index import LexicalIndex, fuse_results, LEXICAL_INDEX_PATH
+from singleflight import create_single_flight, coalesce_key, QUERY_COALESCING_ENABLED
+from context_builder import build_context, build_user_message, SYSTEM_MESSAGE, CONTEXT_MAX_RESULTS
+from openai_client import (
+    create_openai_client, call_with_retry, describe_failure, CircuitOpenError,
+    embedding_breaker, chat_breaker, OPENAI_CHAT_DEADLINE_SECONDS
+)
+from admission import AdmissionQueue, all_queues, QUERY_RETRY_AFTER_SECONDS
+from query_log import QueryLog, query_record, QUERY_LOG_ENABLED
+from metrics import (
+    REGISTRY, CHAT_TOKENS, QUERY_ERRORS, CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED, CONTEXT_ENTRIES,
+    RETRIEVAL_MODES, EMBEDDING_FAILURES,
+    RequestTimings, gauge_lines
+)
+
+# Per-request logging goes through this logger; set LOG_LEVEL=DEBUG to log prompts and full answers
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger("ask_jersey")
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers: # Configure only our logger, leaving library loggers alone
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     print("Warning: OPENAI_API_KEY not found. API calls to OpenAI will fail.")
 
-# Initialize OpenAI client
+# Initialize OpenAI client (pooled connections, explicit timeouts; retries go through openai_client.call_with_retry)
 client_openai = None # Initialize to None
 try:
     if OPENAI_API_KEY: # Only attempt to initialize if key is present
-        client_openai = OpenAI(api_key=OPENAI_API_KEY)
+        client_openai = create_openai_client(OPENAI_API_KEY)
     else:
         print("OpenAI client not initialized due to missing API key.")
 except Exception as e:
@@ -24,9 +61,54 @@ except Exception as e:
     # client_openai remains None
 
 # --- Global constants for ChromaDB and Embeddings ---
-DB_PATH = "./db_chroma"
+DB_PATH = os.getenv("CHROMA_DB_PATH", "./db_chroma")
 COLLECTION_NAME = "jersey_faqs"
 EMBEDDING_MODEL = "text-embedding-ada-002"
+SEED_FILE = "seed_faq.json"
+# How startup keeps the collection in line with seed_faq.json:
+#   incremental (default) - upsert new/changed FAQs, delete removed ones; skipped when the file is unchanged
+#   if_empty              - only populate an empty collection (previous behaviour)
+#   off                   - never touch the collection at startup
+FAQ_SYNC_MODE = os.getenv("FAQ_SYNC_MODE", "incremental").lower()
+# When the Chroma client, FAQ sync and retriever index are set up:
+#   eager (default) - while importing this module, before the app can serve anything
+#   lazy            - in a background thread, so a worker answers /ping at Flask import speed;
+#                     /ready reports when the index is loaded and queries wait up to STARTUP_WAIT_SECONDS
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", "10"))
+
+# --- Hybrid retrieval and embedding-outage fallback (BM25 index, see lexical_index.py) ---
+# Vector and BM25 hits are merged by reciprocal rank fusion; questions that cannot be embedded
+# (API error, or no answer within EMBEDDING_LATENCY_BUDGET_SECONDS) are answered from BM25 alone.
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+LEXICAL_FALLBACK_ENABLED = os.getenv("LEXICAL_FALLBACK_ENABLED", "true").lower() in ("1", "true", "yes")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0")) # Vector ranks weigh 1.0
+# Deadline for a query-time embeddings call, retries included; 0 = no deadline
+EMBEDDING_LATENCY_BUDGET_SECONDS = float(os.getenv("EMBEDDING_LATENCY_BUDGET_SECONDS", "2.0"))
+
+# --- Persistent embedding cache shared by seeding and the query path ---
+embedding_cache = None # Initialize to None; embeddings are then always fetched from OpenAI
+try:
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    print(f"Embedding cache ready at '{EMBEDDING_CACHE_PATH}'.")
+except Exception as e_cache:
+    print(f"Warning: Could not open embedding cache at '{EMBEDDING_CACHE_PATH}': {e_cache}")
+
+# --- Semantic answer cache: serves stored answers for near-duplicate questions ---
+# The FAQ collection version is re-read at most this often; a change drops cached answers and reloads in-process indexes
+FAQ_VERSION_CHECK_SECONDS = float(os.getenv("FAQ_VERSION_CHECK_SECONDS", "10"))
+answer_cache = SemanticAnswerCache() if ANSWER_CACHE_ENABLED else None
+_collection_version = {"value": None, "checked_at": 0.0}
+
+# --- Request coalescing: concurrent identical questions share one pipeline run (see singleflight.py) ---
+query_flights = create_single_flight() if QUERY_COALESCING_ENABLED else None
+
+# --- Admission control: bounded pipeline runs per worker, 503 once the backlog is full (see admission.py) ---
+query_admission = AdmissionQueue()
+
+# --- Query log: compact JSONL records of /api/query requests, for cache warming and replay (see query_log.py) ---
+query_log = QueryLog() if QUERY_LOG_ENABLED else None
 
 # --- Function to populate ChromaDB if empty ---
 def populate_chroma_if_empty(chroma_collection, openai_client_instance, embedding_model_name):
@@ -52,221 +134,997 @@ def populate_chroma_if_empty(chroma_collection, openai_client_instance, embeddin
 
         print(f"Found {len(faqs)} FAQs in seed_faq.json for populating.")
 
-        documents_to_add = []
-        embeddings_to_add = []
-        ids_to_add = []
-        metadatas_to_add = []
-        processed_ids = set()
-
-        for faq_item in faqs:
-            faq_id = str(faq_item.get('id'))
-            question = faq_item.get('question')
-            answer = faq_item.get('answer')
-            source = faq_item.get('source', '')
-            category = faq_item.get('category', '')
-
-            if not faq_id or not question or not answer:
-                print(f"  Skipping FAQ in population due to missing id, question, or answer: {faq_item}")
-                continue
-            
-            if faq_id in processed_ids:
-                print(f"  Warning: Duplicate FAQ ID '{faq_id}' during population. Skipping.")
-                continue
-            processed_ids.add(faq_id)
-
-            text_for_embedding = f"Question: {question}\nAnswer: {answer}"
-            print(f"  Populating: FAQ ID: {faq_id} - '{question[:30]}...'")
-            
-            try:
-                if not openai_client_instance: # Check if client is valid
-                    print(f"  Skipping FAQ ID: {faq_id} - OpenAI client not available for embedding.")
-                    continue
-
-                response = openai_client_instance.embeddings.create(
-                    input=[text_for_embedding],
-                    model=embedding_model_name
-                )
-                embedding = response.data[0].embedding
-                
-                if embedding:
-                    documents_to_add.append(text_for_embedding)
-                    embeddings_to_add.append(embedding)
-                    ids_to_add.append(faq_id)
-                    metadatas_to_add.append({
-                        "question": question, "answer": answer,
-                        "source": source, "category": category
-                    })
-                else:
-                    print(f"  Skipping FAQ ID: {faq_id} due to empty embedding during population.")
-            except Exception as e_embed:
-                print(f"  Error getting embedding for FAQ ID {faq_id} during population: {e_embed}")
-                continue 
-        
-        if documents_to_add:
-            try:
-                chroma_collection.add(
-                    embeddings=embeddings_to_add,
-                    documents=documents_to_add,
-                    metadatas=metadatas_to_add,
-                    ids=ids_to_add
-                )
-                print(f"Successfully added {len(documents_to_add)} FAQs to ChromaDB collection '{chroma_collection.name}'.")
-                print(f"Collection count now: {chroma_collection.count()}")
-            except Exception as e_add:
-                print(f"Error adding documents to Chroma during population: {e_add}")
-        else:
+        records = prepare_faq_records(faqs)
+        if not records:
             print("No new documents were prepared for population (possibly all skipped or empty JSON).")
+            return
+
+        if not openai_client_instance: # Check if client is valid
+            print("  Skipping population - OpenAI client not available for embedding.")
+            return
+
+        # Embeds in concurrent multi-item batches and writes to Chroma in chunks (see ingestion.py)
+        report = ingest_records(chroma_collection, openai_client_instance, records, embedding_model_name,
+                                cache=embedding_cache)
+        print(report.summary())
+        print(f"Collection count now: {chroma_collection.count()}")
     else:
         print(f"ChromaDB collection '{chroma_collection.name}' already populated with {chroma_collection.count()} items. Skipping population.")
 
-# --- Initialize ChromaDB client (persistent) and populate if empty ---
+# --- Function to incrementally sync ChromaDB with seed_faq.json ---
+def sync_chroma_with_seed(chroma_collection, openai_client_instance, embedding_model_name, seed_path=SEED_FILE):
+    """
+    Brings the collection in line with the seed file, embedding only new or changed FAQs and
+    deleting removed ones. Does nothing when the file hash matches the last successful sync.
+    """
+    print(f"Checking if ChromaDB collection is in sync with {seed_path}...")
+    try:
+        seed_hash = file_sha256(seed_path)
+    except FileNotFoundError:
+        print(f"CRITICAL ERROR: {seed_path} not found. Cannot sync ChromaDB.")
+        return
+    except Exception as e_hash:
+        print(f"CRITICAL ERROR: Could not read {seed_path}: {e_hash}")
+        return
+
+    if (chroma_collection.metadata or {}).get(SEED_HASH_KEY) == seed_hash:
+        print(f"{seed_path} unchanged since last sync. Skipping.")
+        return
+
+    try:
+        faqs = load_faq_file(seed_path)
+    except json.JSONDecodeError:
+        print(f"CRITICAL ERROR: Could not decode {seed_path}. Cannot sync ChromaDB.")
+        return
+    except Exception as e_open_json:
+        print(f"CRITICAL ERROR: Could not open or read {seed_path}: {e_open_json}")
+        return
+
+    if not openai_client_instance: # Check if client is valid
+        print("  Skipping sync - OpenAI client not available for embedding.")
+        return
+
+    records = prepare_faq_records(faqs)
+    report = sync_records(chroma_collection, openai_client_instance, records, embedding_model_name,
+                          source_name=os.path.basename(seed_path), cache=embedding_cache, source_hash=seed_hash)
+    print(report.summary())
+    print(f"Collection count now: {chroma_collection.count()}")
+
+# --- Initialize ChromaDB client (persistent), sync the seed FAQs and load the retriever ---
 collection = None # Initialize collection to None globally
 client_chroma = None # Initialize client_chroma globally
+retriever = None # Initialize to None; retrieval then reports an error
+lexical_index = None # Initialize to None; hybrid retrieval and the embedding fallback are then off
+retriever_lock = threading.Lock()
+backend_ready = threading.Event() # Set once initialize_backend() has finished, successfully or not
+backend_state = {"status": "starting", "error": None, "started_at": time.time(), "ready_at": None}
 
-try:
-    if not os.path.exists(DB_PATH):
-        print(f"ChromaDB path '{DB_PATH}' does not exist. Attempting to create it.")
-        os.makedirs(DB_PATH)
-        print(f"ChromaDB path '{DB_PATH}' created.")
-
-    client_chroma = chromadb.PersistentClient(path=DB_PATH)
-    
+def open_collection():
+    """Returns the FAQ collection, creating it if missing (under the seed lock); None if that fails."""
     try:
         collection = client_chroma.get_collection(name=COLLECTION_NAME)
         print(f"Successfully connected to existing ChromaDB collection '{COLLECTION_NAME}'.")
+        return collection
     except Exception: # More specific exceptions can be caught if known, e.g., chromadb.exceptions.CollectionNotFoundError
         print(f"Collection '{COLLECTION_NAME}' not found. Attempting to create it.")
+    try:
+        with seed_lock(DB_PATH):
+            collection = client_chroma.get_or_create_collection(name=COLLECTION_NAME) # Another worker may have won
+        print(f"Successfully created new ChromaDB collection '{COLLECTION_NAME}'.")
+        return collection
+    except Exception as e_create_coll:
+        print(f"CRITICAL ERROR: Failed to create ChromaDB collection '{COLLECTION_NAME}': {e_create_coll}")
+        return None
+
+def load_indexes(collection, build):
+    """
+    Sets the retriever (Chroma or in-process NumPy index, see retrievers.py) and the lexical index
+    for `collection`. With build=False, indexes that are missing or stale are left as None.
+    """
+    global retriever, lexical_index
+    try:
+        retriever = create_retriever(collection, RETRIEVER_BACKEND, build=build)
+        if retriever is not None:
+            print(f"Retriever ready: {retriever.name} backend with {len(retriever)} FAQs.")
+    except Exception as e_retriever:
+        print(f"CRITICAL ERROR: Could not initialize '{RETRIEVER_BACKEND}' retriever: {e_retriever}")
+        backend_state["error"] = str(e_retriever)
+    if HYBRID_RETRIEVAL_ENABLED or LEXICAL_FALLBACK_ENABLED:
         try:
-            collection = client_chroma.create_collection(name=COLLECTION_NAME)
-            print(f"Successfully created new ChromaDB collection '{COLLECTION_NAME}'.")
-        except Exception as e_create_coll:
-            print(f"CRITICAL ERROR: Failed to create ChromaDB collection '{COLLECTION_NAME}': {e_create_coll}")
-            # collection remains None
-
-    if collection and client_openai: 
-        populate_chroma_if_empty(collection, client_openai, EMBEDDING_MODEL)
-    elif not client_openai:
-        print("CRITICAL ERROR: OpenAI client not initialized. Cannot populate ChromaDB or perform RAG.")
-    elif not collection: # This case means collection creation/retrieval failed.
-        print(f"CRITICAL ERROR: ChromaDB collection '{COLLECTION_NAME}' could not be initialized. RAG will not function.")
-    
-    if collection:
-        print(f"Final ChromaDB collection '{COLLECTION_NAME}' count after startup check: {collection.count()}")
-    else:
-        print(f"ChromaDB collection '{COLLECTION_NAME}' is not available after startup.")
+            lexical_index = (LexicalIndex.load_or_build(collection, LEXICAL_INDEX_PATH) if build
+                             else LexicalIndex.load_current(collection, LEXICAL_INDEX_PATH))
+            if lexical_index is not None:
+                print(f"Lexical index ready with {len(lexical_index)} FAQs.")
+        except Exception as e_lexical:
+            print(f"Error loading lexical index; hybrid retrieval and embedding fallback disabled: {e_lexical}")
+
+def initialize_backend():
+    """
+    Opens the Chroma collection, brings it in line with the seed file and loads the retriever.
+    Syncing and rebuilding indexes hold an inter-process lock (see ingestion.seed_lock), so with
+    several gunicorn workers only one embeds and writes; the others wait, then find the
+    collection in sync. A worker with nothing to sync (FAQ_SYNC_MODE=off, e.g. after seeding in
+    the gunicorn master) whose indexes are current never takes the lock, so a long-running
+    ingestion does not hold up its startup.
+    """
+    global client_chroma, collection, retriever, lexical_index
+    try:
+        import chromadb # Imported here so lazy startup does not pay for it before the worker is live
+
+        if not os.path.exists(DB_PATH):
+            print(f"ChromaDB path '{DB_PATH}' does not exist. Attempting to create it.")
+            os.makedirs(DB_PATH)
+            print(f"ChromaDB path '{DB_PATH}' created.")
+
+        client_chroma = chromadb.PersistentClient(path=DB_PATH)
+        collection = open_collection()
+
+        will_sync = bool(collection and client_openai) and FAQ_SYNC_MODE in ("incremental", "if_empty")
+        lexical_wanted = HYBRID_RETRIEVAL_ENABLED or LEXICAL_FALLBACK_ENABLED
+        if collection and not will_sync:
+            if not client_openai:
+                print("CRITICAL ERROR: OpenAI client not initialized. Cannot populate ChromaDB or perform RAG.")
+            else:
+                print(f"FAQ_SYNC_MODE is '{FAQ_SYNC_MODE}'. Skipping ChromaDB population check.")
+            load_indexes(collection, build=False)
+
+        if collection and (will_sync or retriever is None or (lexical_wanted and lexical_index is None)):
+            with seed_lock(DB_PATH):
+                # Re-open after acquiring the lock: an older handle misses metadata written meanwhile
+                collection = client_chroma.get_collection(name=COLLECTION_NAME)
+                if FAQ_SYNC_MODE == "incremental" and client_openai:
+                    sync_chroma_with_seed(collection, client_openai, EMBEDDING_MODEL)
+                elif FAQ_SYNC_MODE == "if_empty" and client_openai:
+                    populate_chroma_if_empty(collection, client_openai, EMBEDDING_MODEL)
+                # Under the same lock, so a stale index is rebuilt by the first worker and loaded by the rest
+                load_indexes(collection, build=True)
+        elif not collection: # This case means collection creation/retrieval failed.
+            print(f"CRITICAL ERROR: ChromaDB collection '{COLLECTION_NAME}' could not be initialized. RAG will not function.")
+
+    except Exception as e_chroma_init:
+        print(f"General critical error initializing ChromaDB client or populating collection: {e_chroma_init}")
+        backend_state["error"] = str(e_chroma_init)
+        # collection and client_chroma might be None
+
+    if not client_openai:
+        backend_state["error"] = "OpenAI client not initialized."
+    backend_state["status"] = "ready" if collection and retriever and client_openai else "failed"
+    backend_state["ready_at"] = time.time()
+    backend_ready.set()
+
+def wait_for_backend(timeout=STARTUP_WAIT_SECONDS):
+    """Waits (up to `timeout` seconds) for a lazy startup to finish. Returns True once it has."""
+    return backend_ready.wait(timeout)
 
-except Exception as e_chroma_init:
-    print(f"General critical error initializing ChromaDB client or populating collection: {e_chroma_init}")
-    # collection and client_chroma might be None
+if STARTUP_MODE == "lazy":
+    print("STARTUP_MODE is 'lazy'. Initializing ChromaDB and the retriever in the background...")
+    threading.Thread(target=initialize_backend, name="backend-init", daemon=True).start()
+else:
+    initialize_backend()
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# --- Helper functions for the embedding cache ---
+def lookup_cached_embedding(text_to_embed):
+    """Returns the cached embedding for a text, or None on a miss or cache error."""
+    if not embedding_cache:
+        return None
+    try:
+        return embedding_cache.get(EMBEDDING_MODEL, text_to_embed)
+    except Exception as e_cache:
+        print(f"Error reading embedding cache: {e_cache}")
+        return None
+
+def store_cached_embedding(text_to_embed, embedding):
+    if not embedding_cache:
+        return
+    try:
+        embedding_cache.put(EMBEDDING_MODEL, text_to_embed, embedding)
+    except Exception as e_cache:
+        print(f"Error writing embedding cache: {e_cache}")
+
 # --- Helper function to get embedding ---
-def get_embedding(text_to_embed):
-    """Gets embedding from OpenAI for a given text."""
+def get_embedding(text_to_embed, raise_errors=False):
+    """
+    Gets embedding for a given text, from the embedding cache if seen before, else from OpenAI.
+    Returns None if it could not be embedded; with `raise_errors`, a failed OpenAI call re-raises.
+    """
+    cached_embedding = lookup_cached_embedding(text_to_embed)
+    if cached_embedding is not None:
+        return cached_embedding
+
     if not client_openai: # Check if client_openai was initialized
         print("OpenAI client not available for get_embedding.")
         return None
     try:
-        response = client_openai.embeddings.create(
+        response = call_with_retry(embedding_breaker, lambda timeout: client_openai.embeddings.create(
             input=[text_to_embed],
-            model=EMBEDDING_MODEL # Uses global EMBEDDING_MODEL
-        )
-        return response.data[0].embedding
+            model=EMBEDDING_MODEL, # Uses global EMBEDDING_MODEL
+            timeout=timeout
+        ), EMBEDDING_LATENCY_BUDGET_SECONDS)
+        embedding = response.data[0].embedding
+    except Exception as e:
+        record_embedding_failure(e)
+        if raise_errors:
+            raise
+        return None
+
+    store_cached_embedding(text_to_embed, embedding)
+    return embedding
+
+def get_embeddings(texts):
+    """
+    Batch counterpart of get_embedding(): cache misses are embedded in a single OpenAI call.
+    Returns a list aligned with `texts`, holding None for texts that could not be embedded.
+    """
+    embeddings = [None] * len(texts)
+    if embedding_cache:
+        try:
+            embeddings = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        except Exception as e_cache:
+            print(f"Error reading embedding cache: {e_cache}")
+
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+    if not client_openai:
+        print("OpenAI client not available for get_embeddings.")
+        return embeddings
+    try:
+        response = call_with_retry(embedding_breaker, lambda timeout: client_openai.embeddings.create(
+            input=[texts[i] for i in missing],
+            model=EMBEDDING_MODEL,
+            timeout=timeout
+        ), EMBEDDING_LATENCY_BUDGET_SECONDS)
     except Exception as e:
-        print(f"Error getting embedding: {e}")
+        record_embedding_failure(e, len(missing))
+        return embeddings
+
+    fetched = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    for i, embedding in zip(missing, fetched):
+        embeddings[i] = embedding
+    if embedding_cache:
+        try:
+            embedding_cache.put_many(EMBEDDING_MODEL, [texts[i] for i in missing], fetched)
+        except Exception as e_cache:
+            print(f"Error writing embedding cache: {e_cache}")
+    return embeddings
+
+def record_embedding_failure(error, count=1):
+    """Logs and counts a failed query-time embeddings call; the caller falls back to the lexical index."""
+    if isinstance(error, CircuitOpenError):
+        reason = "circuit_open"
+    else:
+        reason = "timeout" if isinstance(error, openai.APITimeoutError) else "error"
+    EMBEDDING_FAILURES.inc(count, reason=reason)
+    if reason == "timeout":
+        logger.warning("Embedding request for %d text(s) exceeded the %.1fs latency budget.", count, EMBEDDING_LATENCY_BUDGET_SECONDS)
+    elif reason == "circuit_open":
+        logger.warning("Embeddings circuit open; skipped embedding %d text(s).", count)
+    else:
+        logger.error("Error getting embeddings for %d text(s): %s", count, error)
+
+# --- Helper to detect FAQ collection changes (invalidates the answer cache and NumPy index) ---
+def faq_collection_version():
+    """Returns the collection's version token, re-read from Chroma at most every few seconds."""
+    now = time.time()
+    if now - _collection_version["checked_at"] >= FAQ_VERSION_CHECK_SECONDS:
+        try:
+            # Fetch a fresh handle so writes from seed_chroma.py or other workers are seen
+            _collection_version["value"] = get_collection_version(client_chroma.get_collection(name=COLLECTION_NAME))
+        except Exception as e:
+            print(f"Error reading FAQ collection version: {e}")
+        _collection_version["checked_at"] = now
+    return _collection_version["value"]
+
+# --- Answer cache helpers ---
+def lookup_cached_answer(question_embedding):
+    """
+    Checks the semantic answer cache. Returns (cached_answer or None, collection_version);
+    pass the version back to store_answer() so answers are tied to the FAQs they came from.
+    """
+    if not answer_cache or question_embedding is None:
+        return None, None
+    collection_version = faq_collection_version()
+    cached_answer = answer_cache.lookup(question_embedding, collection_version)
+    if cached_answer:
+        logger.info("Answer cache hit (similarity %.4f, cached question: '%s').",
+                    cached_answer['similarity'], cached_answer['question'])
+    return cached_answer, collection_version
+
+def store_answer(user_question, question_embedding, generated_answer, collection_version):
+    if answer_cache and generated_answer and question_embedding is not None:
+        answer_cache.store(user_question, question_embedding, generated_answer, collection_version)
+
+def answer_cache_status(hit):
+    """Value for the X-Answer-Cache response header."""
+    if not answer_cache:
+        return "DISABLED"
+    return "HIT" if hit else "MISS"
+
+# --- Retrieval ---
+def current_retriever():
+    """Returns the active retriever, rebuilding an in-process index if the FAQ collection has changed."""
+    global retriever
+    if RETRIEVER_BACKEND != "numpy" or not collection:
+        return retriever
+    latest_version = faq_collection_version()
+    if retriever is None or retriever.version != latest_version:
+        with retriever_lock:
+            if retriever is None or retriever.version != latest_version:
+                print("FAQ collection changed. Reloading NumPy retriever index...")
+                try:
+                    # A fresh handle carries the latest metadata (version marker) written by other processes
+                    retriever = create_retriever(client_chroma.get_collection(name=COLLECTION_NAME), RETRIEVER_BACKEND)
+                except Exception as e_retriever:
+                    print(f"Error reloading NumPy retriever index: {e_retriever}")
+    return retriever
+
+def current_lexical_index():
+    """Returns the BM25 index, rebuilding it if the FAQ collection has changed; None when unavailable."""
+    global lexical_index
+    if lexical_index is None or not collection:
+        return lexical_index
+    latest_version = faq_collection_version()
+    if lexical_index.version != latest_version:
+        with retriever_lock:
+            if lexical_index.version != latest_version:
+                print("FAQ collection changed. Reloading lexical index...")
+                try:
+                    lexical_index = LexicalIndex.load_or_build(client_chroma.get_collection(name=COLLECTION_NAME), LEXICAL_INDEX_PATH)
+                except Exception as e_lexical:
+                    print(f"Error reloading lexical index: {e_lexical}")
+    return lexical_index
+
+def lexical_fallback_available():
+    """True if questions that could not be embedded can still be answered from the lexical index."""
+    return LEXICAL_FALLBACK_ENABLED and current_lexical_index() is not None
+
+def retrieve_context(user_question, question_embedding, n_results=CONTEXT_MAX_RESULTS, timings=None):
+    """
+    Queries the configured retriever and returns (documents, metadatas, distances) for the
+    closest FAQs, best match first. Raises on failure. See retrieve_context_batch() for how
+    the lexical index is used.
+    """
+    return retrieve_context_batch([user_question], [question_embedding], n_results, [timings])[0]
+
+def retrieve_context_batch(questions, question_embeddings, n_results=CONTEXT_MAX_RESULTS, timings=None):
+    """
+    Like retrieve_context() for several questions, with one retriever query for all the
+    embedded ones; returns one tuple per question. With hybrid retrieval on, vector hits are
+    fused with BM25 hits; a question whose embedding is None is answered from BM25 alone.
+    Hits found only by BM25 have a distance of None. `timings`, if given, holds one
+    RequestTimings (or None) per question, noted with its retrieval mode, ids and distances.
+    """
+    embedded = [i for i, question_embedding in enumerate(question_embeddings) if question_embedding is not None]
+    vector_results = {}
+    if embedded:
+        active_retriever = current_retriever()
+        if active_retriever is None:
+            raise RuntimeError("Retriever not initialized.")
+        batch_results = active_retriever.query([question_embeddings[i] for i in embedded], n_results=n_results)
+        vector_results = dict(zip(embedded, batch_results))
+
+    index = current_lexical_index() if HYBRID_RETRIEVAL_ENABLED or len(embedded) < len(questions) else None
+    contexts = []
+    for i, user_question in enumerate(questions):
+        results, mode = vector_results.get(i), "vector"
+        if results is None:
+            if index is None or not LEXICAL_FALLBACK_ENABLED:
+                raise RuntimeError("No question embedding and no lexical index to fall back on.")
+            no_vector_hits = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            results = fuse_results(no_vector_hits, index.query([user_question], n_results)[0], n_results)
+            mode = "lexical_fallback"
+        elif HYBRID_RETRIEVAL_ENABLED and index is not None:
+            results = fuse_results(results, index.query([user_question], n_results)[0], n_results,
+                                   HYBRID_RRF_K, HYBRID_LEXICAL_WEIGHT)
+            mode = "hybrid"
+        RETRIEVAL_MODES.inc(mode=mode)
+        if timings and timings[i]:
+            timings[i].note(retrieval_mode=mode, retrieved_ids=results['ids'], distances=results['distances'])
+        contexts.append((results['documents'], results['metadatas'], results['distances']))
+        logger.debug("Retrieved %d documents (%s; distances: %s).", len(results['documents']), mode,
+                     ", ".join("-" if d is None else f"{d:.4f}" for d in results['distances']))
+    return contexts
+
+# --- Distance gates (squared L2, as returned by both retrievers) ---
+# A retrieved FAQ whose *question* is within DIRECT_ANSWER_MAX_DISTANCE of the user's question is
+# answered straight from its stored answer without calling GPT-4o. The stored documents embed
+# question and answer together, so their distance cannot tell "the same question" apart; FAQ
+# question embeddings are kept in the embedding cache instead (see ingestion.missing_questions), and
+# the gate only reads them from there: without the cache, or on a miss, it never calls OpenAI.
+# ada-002 similarities are compressed (unrelated texts still score ~0.7 cosine, and questions on one
+# topic that differ in a word, e.g. "...by employers" vs "...by employees", score 0.95+), so the
+# default 0.03 (cosine 0.985 for these unit vectors) admits rewordings in case, punctuation and
+# spacing but little more. Hits farther than CONTEXT_MAX_DISTANCE are left out of the prompt.
+DIRECT_ANSWER_ENABLED = os.getenv("DIRECT_ANSWER_ENABLED", "true").lower() in ("1", "true", "yes")
+DIRECT_ANSWER_MAX_DISTANCE = float(os.getenv("DIRECT_ANSWER_MAX_DISTANCE", "0.03"))
+DIRECT_ANSWER_TEMPLATE = os.getenv("DIRECT_ANSWER_TEMPLATE", "{answer}") # Placeholders: {answer}, {question}, {source}
+CONTEXT_MAX_DISTANCE = float(os.getenv("CONTEXT_MAX_DISTANCE", "0.5"))
+
+def find_direct_answer(question_embedding, retrieved_metadatas, retrieved_distances):
+    """
+    Returns {"answer", "source", "question", "distance"} for the retrieved FAQ whose question is
+    closest to the user's, if within DIRECT_ANSWER_MAX_DISTANCE; else None. FAQ question
+    embeddings are read from the embedding cache (a SQLite read, so this may block); FAQs
+    whose question is not cached are not answered directly.
+    """
+    if not DIRECT_ANSWER_ENABLED or not embedding_cache or not retrieved_metadatas or question_embedding is None:
+        return None
+    # Whole FAQs only (a passage is just part of its answer, so it goes to GPT-4o as context),
+    # and only hits relevant enough for the prompt; BM25-only hits (distance None) qualify
+    candidates = [i for i, meta in enumerate(retrieved_metadatas)
+                  if meta and meta.get('question') and meta.get('answer') and meta.get('passage_count', 1) <= 1
+                  and (retrieved_distances[i] is None or retrieved_distances[i] <= CONTEXT_MAX_DISTANCE)]
+    if not candidates:
+        return None
+    try:
+        faq_question_embeddings = embedding_cache.get_many(EMBEDDING_MODEL, [retrieved_metadatas[i]['question'] for i in candidates])
+    except Exception as e_cache:
+        print(f"Error reading embedding cache: {e_cache}")
         return None
+    user_vector = np.asarray(question_embedding, dtype=np.float32)
+    question_distances = [(float(np.sum((np.asarray(embedding, dtype=np.float32) - user_vector) ** 2)), i)
+                          for i, embedding in zip(candidates, faq_question_embeddings) if embedding is not None]
+    if not question_distances:
+        return None
+    best_distance, best = min(question_distances)
+    if best_distance > DIRECT_ANSWER_MAX_DISTANCE:
+        return None
+    meta = retrieved_metadatas[best]
+    source = meta.get('source', '')
+    try:
+        answer = DIRECT_ANSWER_TEMPLATE.format(answer=meta['answer'], question=meta.get('question', ''), source=source)
+    except (KeyError, IndexError, ValueError) as e_template:
+        print(f"Invalid DIRECT_ANSWER_TEMPLATE, using the stored answer as is: {e_template}")
+        answer = meta['answer']
+    logger.info("Direct FAQ answer (question distance %.4f, FAQ question: '%s').", best_distance, meta.get('question', ''))
+    return {"answer": answer, "source": source, "question": meta.get('question', ''), "distance": best_distance}
+
+def drop_irrelevant_context(retrieved_documents, retrieved_metadatas, retrieved_distances):
+    """Keeps only the hits within CONTEXT_MAX_DISTANCE, plus BM25-only hits (distance None). Returns (documents, metadatas)."""
+    kept = [i for i, distance in enumerate(retrieved_distances) if distance is None or distance <= CONTEXT_MAX_DISTANCE]
+    if len(kept) < len(retrieved_documents):
+        logger.debug("Dropped %d of %d retrieved documents beyond distance %.2f.",
+                     len(retrieved_documents) - len(kept), len(retrieved_documents), CONTEXT_MAX_DISTANCE)
+    return [retrieved_documents[i] for i in kept], [retrieved_metadatas[i] for i in kept]
+
+def direct_answer_payload(direct_answer):
+    """JSON body (and SSE done fields) for an answer served from the FAQ without GPT-4o."""
+    return {"answer": direct_answer["answer"], "source": direct_answer["source"], "cached": False, "direct": True}
+
+# --- Prompt construction ---
+CHAT_MODEL = "gpt-4o"
+CHAT_TEMPERATURE = 0.3
+
+def build_chat_messages(user_question, retrieved_documents, retrieved_metadatas):
+    """
+    Builds the chat messages for GPT-4o: the static instructions as the system message, then the
+    question with as many retrieved FAQs as fit the context token budget (see context_builder.py).
+    """
+    context = build_context(retrieved_documents, retrieved_metadatas)
+    if not context.entries:
+        logger.info("No relevant documents found for this query.")
+    CONTEXT_TOKENS.observe(context.baseline_tokens, kind="baseline")
+    CONTEXT_TOKENS.observe(context.prompt_tokens, kind="prompt")
+    CONTEXT_TOKENS_SAVED.inc(context.tokens_saved)
+    CONTEXT_ENTRIES.observe(context.entries)
+    logger.debug("Prompt context: %d of %d FAQs, %d prompt tokens (%d saved, %d duplicates%s).",
+                 context.entries, len(retrieved_documents), context.prompt_tokens, context.tokens_saved,
+                 context.duplicates, ", truncated" if context.truncated else "")
+
+    user_message = build_user_message(user_question, context)
+    logger.debug("Constructed prompt for GPT-4o (first 500 chars):\n%s...", user_message["content"][:500])
+    return [SYSTEM_MESSAGE, user_message]
+
+def complete_chat(messages):
+    """Runs a (non-streaming) GPT-4o chat completion and returns the answer text. Raises on failure."""
+    chat_completion = call_with_retry(chat_breaker, lambda timeout: client_openai.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        temperature=CHAT_TEMPERATURE,
+        timeout=timeout
+    ), OPENAI_CHAT_DEADLINE_SECONDS)
+    record_chat_usage(chat_completion.usage)
+    return chat_completion.choices[0].message.content
+
+def open_chat_stream(messages):
+    """Opens a streaming GPT-4o chat completion (retried until the stream opens). Raises on failure."""
+    return call_with_retry(chat_breaker, lambda timeout: client_openai.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        temperature=CHAT_TEMPERATURE,
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=timeout
+    ), OPENAI_CHAT_DEADLINE_SECONDS)
+
+# --- Metrics helpers ---
+def record_chat_usage(usage):
+    """Records prompt/completion token counts from a chat completion's usage block, if present."""
+    if usage is None:
+        return
+    CHAT_TOKENS.observe(usage.prompt_tokens or 0, kind="prompt")
+    CHAT_TOKENS.observe(usage.completion_tokens or 0, kind="completion")
+
+def cache_metrics():
+    """Scrape-time collector exposing the embedding and answer cache counters."""
+    lines = []
+    for cache_name, cache in (("embedding", embedding_cache), ("answer", answer_cache)):
+        if not cache:
+            continue
+        cache_stats = cache.stats()
+        lines += gauge_lines(
+            f"askjersey_{cache_name}_cache_lookups_total", f"{cache_name.capitalize()} cache lookups by result.",
+            [({"result": "hit"}, cache_stats["hits"]), ({"result": "miss"}, cache_stats["misses"])],
+            metric_type="counter"
+        )
+    return lines
+
+REGISTRY.add_collector(cache_metrics)
+
+def coalescing_metrics():
+    """Scrape-time collector exposing how many /api/query requests led or joined a pipeline run."""
+    if not query_flights:
+        return []
+    flight_stats = query_flights.stats()
+    return gauge_lines(
+        "askjersey_query_coalescing_total", "/api/query requests by coalescing role.",
+        [({"role": "leader"}, flight_stats["leaders"]), ({"role": "follower"}, flight_stats["followers"])],
+        metric_type="counter"
+    ) + gauge_lines("askjersey_query_in_flight", "Distinct questions currently being answered.",
+                    [({}, flight_stats["in_flight"])])
+
+REGISTRY.add_collector(coalescing_metrics)
+
+def resilience_metrics():
+    """Scrape-time collector exposing admission queues and OpenAI circuit breakers."""
+    queues = [(queue.name, queue.stats()) for queue in all_queues()]
+    breakers = [(breaker.name, breaker.stats()) for breaker in (embedding_breaker, chat_breaker)]
+    return gauge_lines(
+        "askjersey_query_admission_total", "Requests admitted to or rejected by the admission queue.",
+        [({"queue": name, "result": result}, queue_stats[result]) for name, queue_stats in queues for result in ("admitted", "rejected")],
+        metric_type="counter"
+    ) + gauge_lines(
+        "askjersey_query_admission_slots", "Requests holding (active) or waiting for (waiting) an admission slot.",
+        [({"queue": name, "state": state}, queue_stats[state]) for name, queue_stats in queues for state in ("active", "waiting")]
+    ) + gauge_lines(
+        "askjersey_openai_circuit_open", "1 while an OpenAI circuit breaker is failing fast (open or probing).",
+        [({"operation": name}, 0 if breaker_stats["state"] == "closed" else 1) for name, breaker_stats in breakers]
+    ) + gauge_lines(
+        "askjersey_openai_circuit_rejections_total", "OpenAI calls refused by an open circuit breaker.",
+        [({"operation": name}, breaker_stats["rejected"]) for name, breaker_stats in breakers],
+        metric_type="counter"
+    )
+
+REGISTRY.add_collector(resilience_metrics)
+
+def query_log_metrics():
+    """Scrape-time collector exposing query log records written and dropped (queue full)."""
+    if not query_log:
+        return []
+    log_stats = query_log.stats()
+    return gauge_lines(
+        "askjersey_query_log_records_total", "Query log records by result.",
+        [({"result": "written"}, log_stats["written"]), ({"result": "dropped"}, log_stats["dropped"])],
+        metric_type="counter"
+    )
+
+REGISTRY.add_collector(query_log_metrics)
+
+def record_query(timings, status, cache_status):
+    """Queues the query log record for a finished request; the file is written off the request thread."""
+    query_log.record(query_record(timings, status, cache_status))
+
+def log_query_when_sent(response, timings):
+    """after_this_request hook: logs the request once its response is closed (a stream, once it ends)."""
+    response.call_on_close(lambda: record_query(timings, response.status_code, response.headers.get("X-Answer-Cache")))
+    return response
+
+def query_response(payload, timings, cache_status, status=200):
+    """JSON response for /api/query with cache and (optional) timing headers."""
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers["X-Answer-Cache"] = cache_status
+    timings.apply_headers(response.headers)
+    return response
+
+def query_error(message, status, timings, stage):
+    timings.error(stage)
+    response = jsonify({"error": message})
+    response.status_code = status
+    timings.apply_headers(response.headers)
+    return response
+
+STARTING_UP_MESSAGE = "The service is starting up. Please try again shortly."
+STARTING_UP_RETRY_AFTER = "5" # Seconds, for the Retry-After header while a lazy startup is in progress
+
+def starting_up_error(timings):
+    response = query_error(STARTING_UP_MESSAGE, 503, timings, "starting")
+    response.headers["Retry-After"] = STARTING_UP_RETRY_AFTER
+    return response
+
+OVERLOADED_MESSAGE = "The service is busy. Please try again shortly."
+
+def overloaded_error(timings):
+    """503 for a request turned away by the admission queue."""
+    response = query_error(OVERLOADED_MESSAGE, 503, timings, "overloaded")
+    response.headers["Retry-After"] = QUERY_RETRY_AFTER_SECONDS
+    return response
+
+def chat_error(error, timings):
+    """Error response for a failed chat completion: 503 + Retry-After, 504 on timeouts, else 502."""
+    logger.error("Error calling OpenAI Chat Completions API: %s", error)
+    status, message, retry_after = describe_failure(error)
+    response = query_error(message, status, timings, "chat_completion")
+    if retry_after:
+        response.headers["Retry-After"] = str(int(retry_after))
+    return response
+
+def embedding_error(error, timings):
+    """Error response when the question could not be embedded and there is no lexical fallback; statuses as chat_error()."""
+    status, message, retry_after = describe_failure(error)
+    response = query_error(message, status, timings, "embedding")
+    if retry_after:
+        response.headers["Retry-After"] = str(int(retry_after))
+    return response
+
+# --- Server-sent events helpers for streaming answers ---
+def sse_event(payload, event=None):
+    """Formats one server-sent event with a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+def sse_response(event_stream, cache_status, timings=None):
+    response = Response(stream_with_context(event_stream), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no" # Stop reverse proxies from buffering the stream
+    response.headers["X-Answer-Cache"] = cache_status
+    if timings:
+        timings.apply_headers(response.headers) # Stages up to the start of the stream
+    return response
+
+def stream_answer_payload(payload):
+    """Streams a complete answer payload: its answer as one token, then its other fields in the done event."""
+    fields = dict(payload)
+    yield sse_event({"token": fields.pop("answer")})
+    yield sse_event(fields, event="done")
+
+def stream_cached_answer(answer):
+    return stream_answer_payload({"answer": answer, "cached": True})
+
+def stream_direct_answer(direct_answer):
+    return stream_answer_payload(direct_answer_payload(direct_answer))
+
+def stream_chat_answer(chat_stream, user_question, question_embedding, collection_version, timings, flight=None):
+    """Forwards tokens from a streaming chat completion, then caches (and publishes) the full answer."""
+    answer_parts = []
+    stream_started = time.perf_counter()
+    try:
+        try:
+            for chunk in chat_stream:
+                record_chat_usage(getattr(chunk, "usage", None)) # Sent on the final chunk with include_usage
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    if not answer_parts:
+                        timings.record("chat_first_token", time.perf_counter() - stream_started)
+                    answer_parts.append(token)
+                    yield sse_event({"token": token})
+        except Exception as e_stream:
+            logger.error("Error while streaming OpenAI Chat Completions response: %s", e_stream)
+            timings.error("chat_completion")
+            yield sse_event({"error": "Error generating AI response."}, event="error")
+            return
+
+        timings.record("chat_completion", time.perf_counter() - stream_started)
+        generated_answer = "".join(answer_parts)
+        logger.debug("GPT-4o generated answer (streamed): %s", generated_answer)
+        store_answer(user_question, question_embedding, generated_answer, collection_version)
+        finish_coalesced_query(flight, {"answer": generated_answer, "cached": False})
+        timings.finish("answered")
+        yield sse_event({"cached": False}, event="done")
+    finally:
+        finish_coalesced_query(flight) # No-op once published; releases followers on errors and client disconnects
+
+# --- Request coalescing helpers ---
+def begin_coalesced_query(user_question):
+    """Returns (flight, is_leader) for a question; (None, True) when coalescing is disabled."""
+    if not query_flights:
+        return None, True
+    return query_flights.begin(coalesce_key(user_question))
+
+def finish_coalesced_query(flight, payload=None):
+    """Hands the leader's answer payload to waiting followers; None makes them answer independently."""
+    if flight:
+        query_flights.finish(flight, payload)
+
+def coalesced_response(payload, stream_requested, timings):
+    """Response for a follower, built from the answer payload its leader published."""
+    timings.finish("coalesced")
+    cache_status = answer_cache_status(payload.get("cached", False))
+    if stream_requested:
+        response = sse_response(stream_answer_payload(payload), cache_status, timings)
+    else:
+        response = query_response(payload, timings, cache_status)
+    response.headers["X-Query-Coalesced"] = "true"
+    return response
 
 # --- API Route for Queries ---
 @api_bp.route('/query', methods=['POST'])
 def handle_query():
+    timings = RequestTimings("query")
+    if query_log and not request.headers.get("X-Query-Replay"): # Replayed questions are already in a log
+        after_this_request(lambda response: log_query_when_sent(response, timings))
+    if not wait_for_backend(): # Lazy startup still loading the index
+        return starting_up_error(timings)
     if not client_openai or not collection: # Check if services are available
         error_message = "Backend services not fully initialized: "
         if not client_openai: error_message += "OpenAI client missing. "
         if not collection: error_message += "ChromaDB collection missing."
-        print(error_message) # Log for server admin
-        return jsonify({"error": "Sorry, the AI service is currently experiencing technical difficulties. Please try again later."}), 503
+        logger.error(error_message) # Log for server admin
+        return query_error("Sorry, the AI service is currently experiencing technical difficulties. Please try again later.", 503, timings, "unavailable")
     
     try:
         data = request.get_json()
         user_question = data.get('question')
 
         if not user_question:
-            return jsonify({"error": "No question provided."}), 400
+            return query_error("No question provided.", 400, timings, "validation")
+
+        # Stream tokens as server-sent events when asked to; otherwise keep the JSON contract
+        stream_requested = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+        timings.note(question=user_question, stream=stream_requested)
 
-        print(f"Received question: {user_question}")
+        logger.info("Received question: %s", user_question)
 
-        question_embedding = get_embedding(user_question)
-        if not question_embedding:
-            return jsonify({"error": "Could not generate embedding for the question due to an internal error."}), 500
+        # Identical questions already in flight wait for that run's answer instead of starting their own
+        flight, leader = begin_coalesced_query(user_question)
+        if not leader:
+            with timings.stage("coalesced_wait"):
+                shared_payload = flight.wait()
+            if shared_payload:
+                return coalesced_response(shared_payload, stream_requested, timings)
+            flight = None # The leader failed or timed out: answer this request independently
 
-        print("Querying ChromaDB...")
+        # Only pipeline runs take an admission slot; coalesced followers just wait for their leader
+        if not query_admission.acquire():
+            finish_coalesced_query(flight)
+            return overloaded_error(timings)
+        response = None
         try:
-            results = collection.query(
-                query_embeddings=[question_embedding],
-                n_results=3
-            )
-            retrieved_documents = results.get('documents', [[]])[0]
-            retrieved_metadatas = results.get('metadatas', [[]])[0]
-            print(f"Retrieved {len(retrieved_documents)} documents from ChromaDB.")
-        except Exception as e_query_chroma:
-            print(f"Error querying ChromaDB: {e_query_chroma}")
-            return jsonify({"error": f"Error querying knowledge base."}), 500
-
-        context_for_gpt = "No specific local information found."
-        if retrieved_documents:
-            context_details = []
-            for i, doc_text in enumerate(retrieved_documents):
-                meta = retrieved_metadatas[i] if i < len(retrieved_metadatas) else {}
-                s = meta.get('source', '')
-                detail = f"Context (Source: {s if s else 'N/A'}):\n{doc_text}"
-                context_details.append(detail)
-            context_for_gpt = "\n\n".join(context_details)
-        else:
-             print("No relevant documents found in ChromaDB for this query.")
-
-
-        prompt = f"""
-        You are 'Ask Jersey!', a helpful AI assistant for information about Jersey.
-        Answer the user's question based *only* on the provided context below.
-        If the context states "No specific local information found." or if the context is clearly irrelevant to the question, state that you couldn't find specific information in your current documents for this query, then try to answer the question generally if you can, clearly indicating it's general knowledge.
-        Be concise and helpful. If you use information from a source in the context, you can subtly weave it in or mention it if appropriate (e.g., "According to [source]...").
-
-        Context from Jersey FAQs:
-        ---
-        {context_for_gpt}
-        ---
-
-        User's Question: {user_question}
-
-        Answer:
-        """
-        print(f"Constructed prompt for GPT-4o (first 500 chars):\n{prompt[:500]}...")
-
-        print("Calling OpenAI GPT-4o...")
+            response = answer_query(user_question, stream_requested, timings, flight)
+        finally:
+            # Streamed chat answers publish from their generator; otherwise release followers now
+            if response is None or not response.is_streamed:
+                finish_coalesced_query(flight)
+                query_admission.release()
+            else:
+                response.call_on_close(query_admission.release) # Hold the slot until the stream ends
+        return response
+
+    except Exception as e_handle_query:
+        logger.exception("An unexpected error occurred in /api/query: %s", e_handle_query)
+        return query_error("An unexpected error occurred while processing your question.", 500, timings, "unexpected")
+
+def answer_query(user_question, stream_requested, timings, flight=None):
+    """Runs the /api/query pipeline for one question, publishing the answer to coalesced followers."""
+    embedding_failure = None
+    with timings.stage("embedding"):
+        try:
+            question_embedding = get_embedding(user_question, raise_errors=True)
+        except Exception as e_embedding:
+            question_embedding, embedding_failure = None, e_embedding
+    if not question_embedding:
+        if not lexical_fallback_available():
+            if embedding_failure:
+                return embedding_error(embedding_failure, timings) # Circuit open / timeout: 503 or 504, not a 500
+            return query_error("Could not generate embedding for the question due to an internal error.", 500, timings, "embedding")
+        logger.warning("No embedding for the question. Answering from the lexical index only.")
+
+    with timings.stage("answer_cache"):
+        cached_answer, collection_version = lookup_cached_answer(question_embedding)
+    if cached_answer:
+        finish_coalesced_query(flight, {"answer": cached_answer["answer"], "cached": True})
+        timings.finish("cached")
+        if stream_requested:
+            return sse_response(stream_cached_answer(cached_answer["answer"]), answer_cache_status(True), timings)
+        return query_response({"answer": cached_answer["answer"], "cached": True}, timings, answer_cache_status(True))
+
+    try:
+        with timings.stage("retrieval"):
+            retrieved_documents, retrieved_metadatas, retrieved_distances = retrieve_context(user_question, question_embedding, timings=timings)
+    except Exception as e_query_chroma:
+        logger.error("Error querying knowledge base: %s", e_query_chroma)
+        return query_error("Error querying knowledge base.", 500, timings, "retrieval")
+
+    # Near-exact FAQ match: answer from the stored FAQ, skipping the chat completion
+    direct_answer = find_direct_answer(question_embedding, retrieved_metadatas, retrieved_distances)
+    if direct_answer:
+        finish_coalesced_query(flight, direct_answer_payload(direct_answer))
+        timings.finish("direct")
+        if stream_requested:
+            return sse_response(stream_direct_answer(direct_answer), answer_cache_status(False), timings)
+        return query_response(direct_answer_payload(direct_answer), timings, answer_cache_status(False))
+
+    retrieved_documents, retrieved_metadatas = drop_irrelevant_context(
+        retrieved_documents, retrieved_metadatas, retrieved_distances)
+
+    with timings.stage("prompt_build"):
+        messages = build_chat_messages(user_question, retrieved_documents, retrieved_metadatas)
+
+    if stream_requested:
+        logger.debug("Calling OpenAI %s (streaming)...", CHAT_MODEL)
         try:
-            chat_completion = client_openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are 'Ask Jersey!', a helpful AI assistant providing information about Jersey based on the context given."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3
-            )
-            generated_answer = chat_completion.choices[0].message.content
-            print(f"GPT-4o generated answer: {generated_answer}")
+            # Open the stream before responding so connection errors still return a JSON error
+            with timings.stage("chat_open"):
+                chat_stream = open_chat_stream(messages)
         except Exception as e_openai_chat:
-            print(f"Error calling OpenAI Chat Completions API: {e_openai_chat}")
-            return jsonify({"error": f"Error generating AI response."}), 500
-        
-        final_response = {"answer": generated_answer}
-        return jsonify(final_response), 200
+            return chat_error(e_openai_chat, timings)
+        return sse_response(
+            stream_chat_answer(chat_stream, user_question, question_embedding, collection_version, timings, flight),
+            answer_cache_status(False), timings
+        )
 
-    except Exception as e_handle_query:
-        print(f"An unexpected error occurred in /api/query: {e_handle_query}")
-        return jsonify({"error": "An unexpected error occurred while processing your question."}), 500
+    logger.debug("Calling OpenAI %s...", CHAT_MODEL)
+    try:
+        with timings.stage("chat_completion"):
+            generated_answer = complete_chat(messages)
+        logger.debug("GPT-4o generated answer: %s", generated_answer)
+    except Exception as e_openai_chat:
+        return chat_error(e_openai_chat, timings)
+
+    store_answer(user_question, question_embedding, generated_answer, collection_version)
+    finish_coalesced_query(flight, {"answer": generated_answer, "cached": False})
+
+    timings.finish("answered")
+    return query_response({"answer": generated_answer, "cached": False}, timings, answer_cache_status(False))
+
+# --- Batch API route: many questions per request ---
+QUERY_BATCH_MAX_QUESTIONS = int(os.getenv("QUERY_BATCH_MAX_QUESTIONS", "100"))
+# Chat completions in flight at once for batch requests, shared by all batches in this worker
+QUERY_BATCH_CHAT_CONCURRENCY = int(os.getenv("QUERY_BATCH_CHAT_CONCURRENCY", "16"))
+batch_chat_pool = ThreadPoolExecutor(max_workers=QUERY_BATCH_CHAT_CONCURRENCY, thread_name_prefix="batch-chat")
+
+def complete_admitted_chat(messages):
+    """
+    complete_chat() for one batch question, holding its own admission slot for the call like a
+    single /api/query would. Returns (admitted, answer); not admitted means the worker is overloaded.
+    """
+    if not query_admission.acquire():
+        return False, None
+    try:
+        return True, complete_chat(messages)
+    finally:
+        query_admission.release()
+
+def answer_questions_batch(questions, timings):
+    """
+    Runs the /api/query pipeline for many questions at once: one embeddings call, one
+    retriever query for every question not served from the answer cache, then chat
+    completions in parallel on batch_chat_pool, each holding an admission slot while it
+    runs. Returns one result dict per question, in order, with an "error" key instead of
+    "answer" for questions that failed.
+    """
+    answers = {} # Unique question -> result fields; repeated questions are answered once
+    unique_questions = list(dict.fromkeys(q for q in questions if isinstance(q, str) and q.strip()))
+
+    def fail(question, message, stage):
+        QUERY_ERRORS.inc(stage=stage)
+        answers[question] = {"error": message}
+
+    with timings.stage("embedding"):
+        question_embeddings = get_embeddings(unique_questions)
+
+    pending = [] # (question, embedding or None, collection_version) still needing retrieval
+    fallback_available = lexical_fallback_available()
+    with timings.stage("answer_cache"):
+        for user_question, question_embedding in zip(unique_questions, question_embeddings):
+            if question_embedding is None and not fallback_available:
+                fail(user_question, "Could not generate embedding for the question due to an internal error.", "embedding")
+                continue
+            cached_answer, collection_version = lookup_cached_answer(question_embedding)
+            if cached_answer:
+                answers[user_question] = {"answer": cached_answer["answer"], "cached": True}
+            else:
+                pending.append((user_question, question_embedding, collection_version))
+
+    contexts = []
+    if pending:
+        try:
+            with timings.stage("retrieval"):
+                contexts = retrieve_context_batch([user_question for user_question, _, _ in pending],
+                                                  [question_embedding for _, question_embedding, _ in pending])
+        except Exception as e_query_chroma:
+            logger.error("Error querying knowledge base for %d questions: %s", len(pending), e_query_chroma)
+            for user_question, _, _ in pending:
+                fail(user_question, "Error querying knowledge base.", "retrieval")
+
+    chat_jobs = []
+    with timings.stage("prompt_build"):
+        for (user_question, question_embedding, collection_version), context in zip(pending, contexts):
+            retrieved_documents, retrieved_metadatas, retrieved_distances = context
+            direct_answer = find_direct_answer(question_embedding, retrieved_metadatas, retrieved_distances)
+            if direct_answer:
+                answers[user_question] = direct_answer_payload(direct_answer)
+                continue
+            retrieved_documents, retrieved_metadatas = drop_irrelevant_context(
+                retrieved_documents, retrieved_metadatas, retrieved_distances)
+            messages = build_chat_messages(user_question, retrieved_documents, retrieved_metadatas)
+            chat_jobs.append((user_question, question_embedding, collection_version, messages))
+
+    if chat_jobs:
+        with timings.stage("chat_completion"):
+            futures = [(job, batch_chat_pool.submit(complete_admitted_chat, job[3])) for job in chat_jobs]
+            for (user_question, question_embedding, collection_version, _), future in futures:
+                try:
+                    admitted, generated_answer = future.result()
+                except Exception as e_openai_chat:
+                    logger.error("Error calling OpenAI Chat Completions API: %s", e_openai_chat)
+                    fail(user_question, describe_failure(e_openai_chat)[1], "chat_completion")
+                    continue
+                if not admitted:
+                    fail(user_question, OVERLOADED_MESSAGE, "overloaded")
+                    continue
+                store_answer(user_question, question_embedding, generated_answer, collection_version)
+                answers[user_question] = {"answer": generated_answer, "cached": False}
+
+    results = []
+    for user_question in questions:
+        result = answers.get(user_question) if isinstance(user_question, str) else None
+        results.append(dict({"question": user_question}, **(result or {"error": "No question provided."})))
+    return results
+
+@api_bp.route('/query/batch', methods=['POST'])
+def handle_query_batch():
+    """
+    Answers up to QUERY_BATCH_MAX_QUESTIONS questions in one request.
+    Body: {"questions": ["...", ...]}. Response: {"results": [{"question", "answer", "cached"} | {"question", "error"}, ...]}
+    """
+    timings = RequestTimings("query_batch")
+    if not wait_for_backend():
+        return starting_up_error(timings)
+    if not client_openai or not collection:
+        logger.error("Backend services not fully initialized for /api/query/batch.")
+        return query_error("Sorry, the AI service is currently experiencing technical difficulties. Please try again later.", 503, timings, "unavailable")
+
+    data = request.get_json(silent=True)
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return query_error("Provide a non-empty 'questions' list.", 400, timings, "validation")
+    if len(questions) > QUERY_BATCH_MAX_QUESTIONS:
+        return query_error(f"Too many questions: at most {QUERY_BATCH_MAX_QUESTIONS} per batch.", 400, timings, "validation")
+
+    logger.info("Received batch of %d questions.", len(questions))
+    if not query_admission.acquire(): # A batch takes one slot, and each of its chat completions another
+        return overloaded_error(timings)
+    try:
+        results = answer_questions_batch(questions, timings)
+    except Exception as e_handle_batch:
+        logger.exception("An unexpected error occurred in /api/query/batch: %s", e_handle_batch)
+        return query_error("An unexpected error occurred while processing your questions.", 500, timings, "unexpected")
+    finally:
+        query_admission.release()
+
+    timings.finish("answered")
+    response = jsonify({"results": results})
+    timings.apply_headers(response.headers)
+    return response
+
+# --- API Route for cache statistics ---
+@api_bp.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "coalescing": query_flights.stats() if query_flights else None,
+        "admission": {queue.name: queue.stats() for queue in all_queues()},
+        "openai_circuits": {breaker.name: breaker.stats() for breaker in (embedding_breaker, chat_breaker)},
+        "query_log": query_log.stats() if query_log else None
+    })
 
 app.register_blueprint(api_bp)
 
@@ -276,8 +1134,31 @@ def home():
 
 @app.route("/ping")
 def ping():
+    """Liveness check: the worker process is up. Does not touch ChromaDB or OpenAI."""
     return jsonify({"status": "alive", "message": "pong"})
 
+@app.route("/ready")
+def ready():
+    """Readiness check: 200 once the collection and retriever are loaded, 503 while starting or after a failed startup."""
+    status = backend_state["status"]
+    body = {"status": status, "startup_mode": STARTUP_MODE}
+    if status == "ready":
+        body["retriever"] = retriever.name
+        body["lexical_index"] = lexical_index is not None
+        body["startup_seconds"] = round(backend_state["ready_at"] - backend_state["started_at"], 3)
+    elif status == "failed":
+        body["error"] = backend_state["error"] or "ChromaDB collection or retriever unavailable."
+    response = jsonify(body)
+    response.status_code = 200 if status == "ready" else 503
+    if status == "starting":
+        response.headers["Retry-After"] = STARTING_UP_RETRY_AFTER
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text-format metrics for this worker process."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,315 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as rag # Runs the normal startup: OpenAI/Chroma clients, caches, population check
+from metrics import RequestTimings
+from singleflight import QUERY_COALESCE_WAIT_SECONDS, QUERY_COALESCE_POLL_SECONDS
+from openai_client import (
+    create_async_openai_client, call_with_retry_async, describe_failure,
+    embedding_breaker, chat_breaker, OPENAI_CHAT_DEADLINE_SECONDS
+)
+from admission import AsyncAdmissionQueue, QUERY_RETRY_AFTER_SECONDS
+
+# Async serving mode: /api/query runs on the event loop with the async OpenAI client, so a
+# single worker process can hold hundreds of questions in flight while waiting on OpenAI.
+# Blocking work (Chroma queries, SQLite cache reads) is offloaded to a bounded thread pool.
+# Every other route is served by the regular Flask app, mounted through WsgiToAsgi.
+#
+# Run with:  SERVING_MODE=async gunicorn --config gunicorn.conf.py
+#   or:      uvicorn asgi:application
+
+ASYNC_BLOCKING_POOL_SIZE = int(os.getenv("ASYNC_BLOCKING_POOL_SIZE", "32"))
+
+blocking_pool = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_POOL_SIZE, thread_name_prefix="rag-blocking")
+
+client_openai_async = None # Initialize to None
+try:
+    if rag.OPENAI_API_KEY:
+        client_openai_async = create_async_openai_client(rag.OPENAI_API_KEY)
+    else:
+        print("Async OpenAI client not initialized due to missing API key.")
+except Exception as e:
+    print(f"Error initializing async OpenAI client: {e}")
+
+# Pipeline runs on this event loop, bounded like app.query_admission (Flask routes keep using that one)
+query_admission_async = AsyncAdmissionQueue()
+
+
+async def run_blocking(func, *args):
+    """Runs a blocking call in the shared thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool, func, *args)
+
+
+async def get_embedding_async(text_to_embed, raise_errors=False):
+    """Async counterpart of app.get_embedding(), sharing the same embedding cache."""
+    cached_embedding = await run_blocking(rag.lookup_cached_embedding, text_to_embed)
+    if cached_embedding is not None:
+        return cached_embedding
+    try:
+        response = await call_with_retry_async(embedding_breaker, lambda timeout: client_openai_async.embeddings.create(
+            input=[text_to_embed],
+            model=rag.EMBEDDING_MODEL,
+            timeout=timeout
+        ), rag.EMBEDDING_LATENCY_BUDGET_SECONDS)
+        embedding = response.data[0].embedding
+    except Exception as e:
+        rag.record_embedding_failure(e)
+        if raise_errors:
+            raise
+        return None
+    await run_blocking(rag.store_cached_embedding, text_to_embed, embedding)
+    return embedding
+
+
+def timing_headers(timings, headers):
+    timings.apply_headers(headers)
+    return headers
+
+
+def json_response(payload, timings, cache_status, status_code=200):
+    return JSONResponse(payload, status_code=status_code,
+                        headers=timing_headers(timings, {"X-Answer-Cache": cache_status}))
+
+
+def error_response(message, status_code, timings, stage, retry_after=None):
+    timings.error(stage)
+    headers = {"Retry-After": str(retry_after)} if retry_after else {}
+    return JSONResponse({"error": message}, status_code=status_code, headers=timing_headers(timings, headers))
+
+
+def chat_error_response(error, timings):
+    """Async counterpart of app.chat_error()."""
+    rag.logger.error("Error calling OpenAI Chat Completions API: %s", error)
+    status, message, retry_after = describe_failure(error)
+    return error_response(message, status, timings, "chat_completion", int(retry_after) if retry_after else None)
+
+
+def embedding_error_response(error, timings):
+    """Async counterpart of app.embedding_error()."""
+    status, message, retry_after = describe_failure(error)
+    return error_response(message, status, timings, "embedding", int(retry_after) if retry_after else None)
+
+
+def log_query_when_sent(response, timings):
+    """Async counterpart of app.log_query_when_sent(): logs the request after the response (or stream) is sent."""
+    if rag.query_log and timings.details.get("question"):
+        tasks = BackgroundTasks([response.background] if response.background else [])
+        tasks.add_task(rag.record_query, timings, response.status_code, response.headers.get("x-answer-cache"))
+        response.background = tasks
+    return response
+
+
+def sse_streaming_response(event_stream, cache_status, timings):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Answer-Cache": cache_status}
+    return StreamingResponse(event_stream, media_type="text/event-stream", headers=timing_headers(timings, headers))
+
+
+async def stream_events_async(events):
+    """Wraps one of app.py's precomputed event generators (cached or direct answers) for StreamingResponse."""
+    for event in events:
+        yield event
+
+
+async def stream_chat_answer_async(chat_stream, user_question, question_embedding, collection_version, timings, flight=None):
+    """Async counterpart of app.stream_chat_answer()."""
+    answer_parts = []
+    stream_started = time.perf_counter()
+    try:
+        try:
+            async for chunk in chat_stream:
+                rag.record_chat_usage(getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    if not answer_parts:
+                        timings.record("chat_first_token", time.perf_counter() - stream_started)
+                    answer_parts.append(token)
+                    yield rag.sse_event({"token": token})
+        except Exception as e_stream:
+            rag.logger.error("Error while streaming OpenAI Chat Completions response: %s", e_stream)
+            timings.error("chat_completion")
+            yield rag.sse_event({"error": "Error generating AI response."}, event="error")
+            return
+
+        timings.record("chat_completion", time.perf_counter() - stream_started)
+        generated_answer = "".join(answer_parts)
+        rag.logger.debug("GPT-4o generated answer (streamed): %s", generated_answer)
+        await run_blocking(rag.store_answer, user_question, question_embedding, generated_answer, collection_version)
+        await run_blocking(rag.finish_coalesced_query, flight, {"answer": generated_answer, "cached": False})
+        timings.finish("answered")
+        yield rag.sse_event({"cached": False}, event="done")
+    finally:
+        # Called directly: on a client disconnect this generator is cancelled, and an await here would
+        # never complete, leaving followers waiting out QUERY_COALESCE_WAIT_SECONDS
+        rag.finish_coalesced_query(flight) # No-op once published
+
+
+async def wait_for_flight(flight):
+    """Waits for a coalesced question's leader without tying up the event loop."""
+    if flight.polls_store:
+        return await run_blocking(flight.wait) # One poller per question per process; local followers poll below
+    deadline = time.monotonic() + QUERY_COALESCE_WAIT_SECONDS
+    while not flight.done() and time.monotonic() < deadline:
+        await asyncio.sleep(QUERY_COALESCE_POLL_SECONDS)
+    return flight.result
+
+
+async def handle_query_async(request):
+    """Same contract as app.handle_query(): JSON by default, server-sent events on request."""
+    timings = RequestTimings("query")
+    response = await respond_to_query_async(request, timings)
+    if request.headers.get("x-query-replay"): # Replayed questions are already in a log
+        return response
+    return log_query_when_sent(response, timings)
+
+
+async def respond_to_query_async(request, timings):
+    if not rag.backend_ready.is_set() and not await run_blocking(rag.wait_for_backend):
+        return error_response(rag.STARTING_UP_MESSAGE, 503, timings, "starting", rag.STARTING_UP_RETRY_AFTER)
+    if not client_openai_async or not rag.collection:
+        rag.logger.error("Backend services not fully initialized for async /api/query.")
+        return error_response("Sorry, the AI service is currently experiencing technical difficulties. Please try again later.", 503, timings, "unavailable")
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        user_question = data.get('question') if isinstance(data, dict) else None
+
+        if not user_question:
+            return error_response("No question provided.", 400, timings, "validation")
+
+        stream_requested = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('accept', '')
+        timings.note(question=user_question, stream=stream_requested)
+
+        rag.logger.info("Received question: %s", user_question)
+
+        flight, leader = await run_blocking(rag.begin_coalesced_query, user_question)
+        if not leader:
+            with timings.stage("coalesced_wait"):
+                shared_payload = await wait_for_flight(flight)
+            if shared_payload:
+                return coalesced_response(shared_payload, stream_requested, timings)
+            flight = None # The leader failed or timed out: answer this request independently
+
+        if not await query_admission_async.acquire():
+            rag.finish_coalesced_query(flight)
+            return error_response(rag.OVERLOADED_MESSAGE, 503, timings, "overloaded", QUERY_RETRY_AFTER_SECONDS)
+        response = None
+        try:
+            response = await answer_query_async(user_question, stream_requested, timings, flight)
+        finally:
+            # Streamed chat answers publish from their generator; otherwise release followers now
+            if isinstance(response, StreamingResponse):
+                response.background = BackgroundTask(query_admission_async.release) # Runs once the stream ends
+            else:
+                rag.finish_coalesced_query(flight) # Not awaited, so it also runs when the request is cancelled
+                await query_admission_async.release()
+        return response
+
+    except Exception as e_handle_query:
+        rag.logger.exception("An unexpected error occurred in async /api/query: %s", e_handle_query)
+        return error_response("An unexpected error occurred while processing your question.", 500, timings, "unexpected")
+
+
+def coalesced_response(payload, stream_requested, timings):
+    """Async counterpart of app.coalesced_response()."""
+    timings.finish("coalesced")
+    cache_status = rag.answer_cache_status(payload.get("cached", False))
+    if stream_requested:
+        response = sse_streaming_response(stream_events_async(rag.stream_answer_payload(payload)), cache_status, timings)
+    else:
+        response = json_response(payload, timings, cache_status)
+    response.headers["X-Query-Coalesced"] = "true"
+    return response
+
+
+async def answer_query_async(user_question, stream_requested, timings, flight=None):
+    """Async counterpart of app.answer_query()."""
+    embedding_failure = None
+    with timings.stage("embedding"):
+        try:
+            question_embedding = await get_embedding_async(user_question, raise_errors=True)
+        except Exception as e_embedding:
+            question_embedding, embedding_failure = None, e_embedding
+    if not question_embedding:
+        if not await run_blocking(rag.lexical_fallback_available):
+            if embedding_failure:
+                return embedding_error_response(embedding_failure, timings)
+            return error_response("Could not generate embedding for the question due to an internal error.", 500, timings, "embedding")
+        rag.logger.warning("No embedding for the question. Answering from the lexical index only.")
+
+    with timings.stage("answer_cache"):
+        cached_answer, collection_version = await run_blocking(rag.lookup_cached_answer, question_embedding)
+    if cached_answer:
+        await run_blocking(rag.finish_coalesced_query, flight, {"answer": cached_answer["answer"], "cached": True})
+        timings.finish("cached")
+        if stream_requested:
+            return sse_streaming_response(stream_events_async(rag.stream_cached_answer(cached_answer["answer"])), rag.answer_cache_status(True), timings)
+        return json_response({"answer": cached_answer["answer"], "cached": True}, timings, rag.answer_cache_status(True))
+
+    try:
+        with timings.stage("retrieval"):
+            retrieved_documents, retrieved_metadatas, retrieved_distances = await run_blocking(rag.retrieve_context, user_question, question_embedding, rag.CONTEXT_MAX_RESULTS, timings)
+    except Exception as e_query_chroma:
+        rag.logger.error("Error querying knowledge base: %s", e_query_chroma)
+        return error_response("Error querying knowledge base.", 500, timings, "retrieval")
+
+    direct_answer = await run_blocking(rag.find_direct_answer, question_embedding, retrieved_metadatas, retrieved_distances)
+    if direct_answer:
+        await run_blocking(rag.finish_coalesced_query, flight, rag.direct_answer_payload(direct_answer))
+        timings.finish("direct")
+        if stream_requested:
+            return sse_streaming_response(stream_events_async(rag.stream_direct_answer(direct_answer)), rag.answer_cache_status(False), timings)
+        return json_response(rag.direct_answer_payload(direct_answer), timings, rag.answer_cache_status(False))
+
+    retrieved_documents, retrieved_metadatas = rag.drop_irrelevant_context(
+        retrieved_documents, retrieved_metadatas, retrieved_distances)
+
+    with timings.stage("prompt_build"):
+        messages = rag.build_chat_messages(user_question, retrieved_documents, retrieved_metadatas)
+
+    rag.logger.debug("Calling OpenAI %s (async%s)...", rag.CHAT_MODEL, ", streaming" if stream_requested else "")
+    chat_options = {"stream": True, "stream_options": {"include_usage": True}} if stream_requested else {}
+    try:
+        with timings.stage("chat_completion" if not stream_requested else "chat_open"):
+            chat_completion = await call_with_retry_async(chat_breaker, lambda timeout: client_openai_async.chat.completions.create(
+                model=rag.CHAT_MODEL,
+                messages=messages,
+                temperature=rag.CHAT_TEMPERATURE,
+                timeout=timeout,
+                **chat_options
+            ), OPENAI_CHAT_DEADLINE_SECONDS)
+    except Exception as e_openai_chat:
+        return chat_error_response(e_openai_chat, timings)
+
+    if stream_requested:
+        return sse_streaming_response(
+            stream_chat_answer_async(chat_completion, user_question, question_embedding, collection_version, timings, flight),
+            rag.answer_cache_status(False), timings
+        )
+
+    generated_answer = chat_completion.choices[0].message.content
+    rag.record_chat_usage(chat_completion.usage)
+    rag.logger.debug("GPT-4o generated answer: %s", generated_answer)
+    await run_blocking(rag.store_answer, user_question, question_embedding, generated_answer, collection_version)
+    await run_blocking(rag.finish_coalesced_query, flight, {"answer": generated_answer, "cached": False})
+    timings.finish("answered")
+    return json_response({"answer": generated_answer, "cached": False}, timings, rag.answer_cache_status(False))
+
+
+application = Starlette(routes=[
+    Route('/api/query', handle_query_async, methods=['POST']),
+    Mount('/', app=WsgiToAsgi(rag.app)), # Everything else (/, /ping, /ready, /metrics, /api/stats, static files) stays on Flask
+])
@@ -0,0 +1,162 @@
+"""
+Compares query latency and resident memory of the Chroma and NumPy retrievers.
+
+Usage:
+    python benchmarks/bench_retrievers.py                      # synthetic corpus (default 5000 docs)
+    python benchmarks/bench_retrievers.py --docs 35 --dim 1536
+    python benchmarks/bench_retrievers.py --db ./db_chroma     # benchmark the real collection
+
+Each backend runs in its own subprocess so resident memory is measured independently.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COLLECTION_NAME = "jersey_faqs"
+
+
+def resident_memory_mb():
+    """Current resident set size in MB (Linux /proc, falling back to peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) * 1000 if values else 0.0
+
+
+def build_synthetic_collection(db_path, n_docs, dim, seed):
+    import chromadb
+    from ingestion import mark_collection_changed
+
+    rng = np.random.default_rng(seed)
+    client = chromadb.PersistentClient(path=db_path)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    for start in range(0, n_docs, 1000):
+        count = min(1000, n_docs - start)
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"doc_{i}" for i in range(start, start + count)],
+            embeddings=vectors.tolist(),
+            documents=[f"Question: synthetic {i}\nAnswer: synthetic answer {i}" for i in range(start, start + count)],
+            metadatas=[{"question": f"synthetic {i}", "answer": f"answer {i}", "source": "", "category": f"c{i % 10}"}
+                       for i in range(start, start + count)]
+        )
+    mark_collection_changed(collection)
+
+
+def run_backend(args):
+    """Subprocess entry point: load one backend, time queries, print a JSON result line."""
+    import chromadb
+    from retrievers import create_retriever
+
+    rss_before = resident_memory_mb()
+    load_started = time.perf_counter()
+    collection = chromadb.PersistentClient(path=args.db).get_collection(name=COLLECTION_NAME)
+    index_path = os.path.join(args.workdir, "numpy_index")
+    retriever = create_retriever(collection, args.backend, index_path)
+    if args.backend == "numpy":
+        retriever.query([[1.0] * args.dim], n_results=1)  # Touch the memory map so RSS reflects the loaded matrix
+    load_seconds = time.perf_counter() - load_started
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32).tolist()
+
+    retriever.query(queries[:5], n_results=args.k)  # Warm-up
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        retriever.query([query], n_results=args.k)
+        latencies.append(time.perf_counter() - started)
+
+    batch_started = time.perf_counter()
+    for start in range(0, len(queries), args.batch):
+        retriever.query(queries[start:start + args.batch], n_results=args.k)
+    batch_seconds = time.perf_counter() - batch_started
+
+    filtered = []
+    for query in queries[:100]:
+        started = time.perf_counter()
+        retriever.query([query], n_results=args.k, where={"category": "c1"})
+        filtered.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        "backend": args.backend,
+        "docs": len(retriever),
+        "load_ms": load_seconds * 1000,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "filtered_p50_ms": percentile(filtered, 50),
+        "batched_qps": len(queries) / batch_seconds if batch_seconds else 0.0,
+        "rss_mb": resident_memory_mb(),
+        "rss_delta_mb": resident_memory_mb() - rss_before,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Existing Chroma directory to benchmark (default: build a synthetic one)")
+    parser.add_argument("--docs", type=int, default=5000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension (ada-002 is 1536)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3, help="n_results per query")
+    parser.add_argument("--batch", type=int, default=50, help="Queries per call in the batched run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.db:
+            args.db = os.path.join(workdir, "db_chroma")
+            print(f"Building synthetic collection: {args.docs} docs x {args.dim} dims...")
+            build_synthetic_collection(args.db, args.docs, args.dim, args.seed)
+
+        # Build the NumPy index up front so its subprocess measures a normal startup load
+        import chromadb
+        from retrievers import NumpyRetriever
+        NumpyRetriever.build_from_collection(
+            chromadb.PersistentClient(path=args.db).get_collection(name=COLLECTION_NAME),
+            os.path.join(workdir, "numpy_index")
+        )
+
+        results = []
+        for backend in ("chroma", "numpy"):
+            command = [sys.executable, os.path.abspath(__file__), "--backend", backend, "--workdir", workdir,
+                       "--db", args.db, "--dim", str(args.dim), "--queries", str(args.queries),
+                       "--k", str(args.k), "--batch", str(args.batch), "--seed", str(args.seed)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"\n{'backend':<8} {'docs':>6} {'load ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'filt p50':>9} {'batch q/s':>10} {'RSS MB':>8} {'+RSS MB':>8}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['docs']:>6} {r['load_ms']:>9.1f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['filtered_p50_ms']:>9.3f} {r['batched_qps']:>10.0f} "
+              f"{r['rss_mb']:>8.1f} {r['rss_delta_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
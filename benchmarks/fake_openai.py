@@ -0,0 +1,228 @@
+"""
+Local stand-in for the OpenAI API, for benchmarks and load tests that should not spend
+money or depend on network latency. Implements the two endpoints the app uses:
+
+    POST /v1/embeddings          deterministic unit vectors derived from each input's hash
+    POST /v1/chat/completions    canned answer, optionally streamed token by token (SSE)
+    GET  /stats                  request counters (JSON); POST /stats/reset clears them
+
+Latency, jitter, streaming speed and error rates are configurable, e.g.:
+
+    python benchmarks/fake_openai.py --port 8765 --chat-latency 0.8 --jitter 0.3 --error-rate 0.01
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 (any OPENAI_API_KEY works).
+"""
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+ANSWER_TEXT = (
+    "According to the Jersey FAQs, this is a simulated answer produced by the local benchmark "
+    "server. It is long enough to exercise streaming and token accounting without calling OpenAI."
+)
+
+
+class FakeOpenAIConfig:
+    def __init__(self, embedding_latency=0.05, chat_latency=0.5, jitter=0.2, token_delay=0.01,
+                 error_rate=0.0, rate_limit_rate=0.0, dim=1536, seed=0):
+        self.embedding_latency = embedding_latency  # Seconds per embeddings request
+        self.chat_latency = chat_latency            # Seconds before the first token / full response
+        self.jitter = jitter                        # +/- fraction applied to every latency
+        self.token_delay = token_delay              # Seconds between streamed tokens
+        self.error_rate = error_rate                # Fraction of requests answered with HTTP 500
+        self.rate_limit_rate = rate_limit_rate      # Fraction of requests answered with HTTP 429
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def delay(self, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            factor = 1 + self.rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, seconds * factor))
+
+    def roll_failure(self):
+        """Returns an HTTP status to fail with, or None."""
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.rate_limit_rate:
+            return 429
+        return None
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for a text (same text, same vector)."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_handler(config):
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass # Keep benchmark output clean
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _fail(self, status):
+            config.count(f"errors_{status}")
+            error_type = "rate_limit_error" if status == 429 else "server_error"
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json(status, {"error": {"message": "Simulated failure", "type": error_type}}, headers)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with config.lock:
+                    self._send_json(200, dict(config.counters))
+            else:
+                self._send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+
+            if self.path.rstrip("/") == "/stats/reset":
+                with config.lock:
+                    config.counters.clear()
+                self._send_json(200, {"reset": True})
+            elif self.path.endswith("/embeddings"):
+                self._embeddings(body)
+            elif self.path.endswith("/chat/completions"):
+                self._chat(body)
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def _embeddings(self, body):
+            inputs = body.get("input") or []
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            config.count("embedding_requests")
+            config.count("embedding_inputs", len(inputs))
+            config.delay(config.embedding_latency)
+            status = config.roll_failure()
+            if status:
+                return self._fail(status)
+            tokens = sum(len(text.split()) for text in inputs)
+            self._send_json(200, {
+                "object": "list",
+                "model": body.get("model", "text-embedding-ada-002"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, config.dim)}
+                         for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        def _chat(self, body):
+            config.count("chat_requests")
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+            words = ANSWER_TEXT.split(" ")
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                     "total_tokens": prompt_tokens + len(words)}
+            config.delay(config.chat_latency)
+            status = config.roll_failure()
+            if status:
+                return self._fail(status)
+
+            base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+            if not body.get("stream"):
+                return self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": ANSWER_TEXT}, "finish_reason": "stop"}
+                ]))
+
+            config.count("chat_streams")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                chunk = dict(base, object="chat.completion.chunk",
+                             choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+                self._send_chunk(f"data: {json.dumps(chunk)}\n\n")
+                config.delay(config.token_delay)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._send_chunk(f"data: {json.dumps(dict(base, object='chat.completion.chunk', choices=[], usage=usage))}\n\n")
+            self._send_chunk("data: [DONE]\n\n")
+            self._send_chunk("")  # Terminating zero-length chunk
+
+    return FakeOpenAIHandler
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return # The client gave up waiting (e.g. the app's embedding latency budget ran out)
+        super().handle_error(request, client_address)
+
+
+def serve(host="127.0.0.1", port=8765, config=None):
+    """Starts the server in a daemon thread and returns it (call .shutdown() to stop)."""
+    server = FakeOpenAIServer((host, port), make_handler(config or FakeOpenAIConfig()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings call")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds to first token / full answer")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a +/- fraction")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls failing with HTTP 429")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+
+
+def config_from_args(args):
+    return FakeOpenAIConfig(args.embedding_latency, args.chat_latency, args.jitter, args.token_delay,
+                            args.error_rate, args.rate_limit_rate, args.dim)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), make_handler(config_from_args(args)))
+    print(f"Fake OpenAI API listening on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
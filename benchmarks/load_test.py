@@ -0,0 +1,253 @@
+"""
+Load-tests /api/query under gunicorn against the local fake OpenAI server, so throughput
+can be measured without spending OpenAI money or depending on network latency.
+
+Usage:
+    python benchmarks/load_test.py                                   # sync workers, JSON answers
+    python benchmarks/load_test.py --mode async --concurrency 64 --requests 1000
+    python benchmarks/load_test.py --stream --chat-latency 1.0       # measures time to first byte too
+    python benchmarks/load_test.py --url http://127.0.0.1:5000       # drive an already running server
+
+Unless --url is given, the script starts benchmarks/fake_openai.py in-process and gunicorn
+(gunicorn.conf.py, which seeds from seed_faq.json before forking workers) in a subprocess
+with a temporary Chroma directory, embedding cache and NumPy index. The per-stage
+breakdown is read from the Server-Timing headers the app emits with TIMING_HEADERS_ENABLED=true.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_openai import serve, add_config_arguments, config_from_args
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) * 1000 if values else 0.0
+
+
+def load_questions(path, paraphrase_rate, seed):
+    """FAQ questions from the seed file; a fraction get a suffix so they miss the caches."""
+    with open(path, 'r', encoding='utf-8') as f:
+        questions = [faq["question"] for faq in json.load(f) if faq.get("question")]
+    rng = random.Random(seed)
+
+    def next_question(i):
+        question = rng.choice(questions)
+        if rng.random() < paraphrase_rate:
+            question = f"{question} (variant {i})"
+        return question
+    return next_question
+
+
+def parse_server_timing(header):
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration) / 1000
+    return stages
+
+
+def wait_until_ready(base_url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/ready", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout}s")
+
+
+def server_env(args, workdir, fake_url, port):
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake-benchmark",
+        OPENAI_BASE_URL=fake_url,
+        SERVING_MODE=args.mode,
+        WEB_CONCURRENCY=str(args.workers),
+        PORT=str(port),
+        CHROMA_DB_PATH=os.path.join(workdir, "db_chroma"),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.sqlite3"),
+        NUMPY_INDEX_PATH=os.path.join(workdir, "db_numpy"),
+        LEXICAL_INDEX_PATH=os.path.join(workdir, "db_lexical"),
+        TIMING_HEADERS_ENABLED="true",
+        LOG_LEVEL="WARNING",
+    )
+    if args.no_answer_cache:
+        env["ANSWER_CACHE_ENABLED"] = "false"
+    if args.retriever:
+        env["RETRIEVER_BACKEND"] = args.retriever
+    return env
+
+
+def start_gunicorn(env, verbose, port):
+    command = [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}"]
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=None if verbose else subprocess.DEVNULL)
+
+
+def send_query(base_url, question, stream, timeout, extra_headers=None):
+    """Sends one question; returns a result dict with latency, ttfb, status and stages."""
+    body = json.dumps({"question": question, "stream": stream}).encode("utf-8")
+    headers = dict({"Content-Type": "application/json"}, **(extra_headers or {}))
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    request = urllib.request.Request(f"{base_url}/api/query", data=body, headers=headers, method="POST")
+    started = time.perf_counter()
+    result = {"status": 0, "ttfb": None, "cache": None, "stages": {}}
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            result["status"] = response.status
+            result["cache"] = response.headers.get("X-Answer-Cache")
+            result["stages"] = parse_server_timing(response.headers.get("Server-Timing"))
+            if stream:
+                first_line = response.readline()
+                result["ttfb"] = time.perf_counter() - started
+                if first_line.startswith(b"event: error"):
+                    result["status"] = 502
+                for line in response:
+                    if line.startswith(b"event: error"):
+                        result["status"] = 502
+            else:
+                response.read()
+    except urllib.error.HTTPError as e:
+        result["status"] = e.code
+        e.read()
+    except Exception:
+        result["status"] = -1
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+def run_load(base_url, args):
+    next_question = load_questions(os.path.join(REPO_ROOT, args.seed_file), args.paraphrase_rate, args.seed)
+    question_lock = threading.Lock()
+
+    def worker(i):
+        with question_lock:
+            question = next_question(i)
+        return send_query(base_url, question, args.stream, args.timeout)
+
+    for i in range(args.warmup):
+        worker(-1 - i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(worker, range(args.requests)))
+    return results, time.perf_counter() - started
+
+
+def report(results, elapsed, args):
+    ok = [r for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[r["status"]] = errors.get(r["status"], 0) + 1
+    latencies = [r["latency"] for r in ok]
+
+    print(f"\nmode={args.mode} workers={args.workers} concurrency={args.concurrency} "
+          f"stream={args.stream} answer_cache={'off' if args.no_answer_cache else 'on'}")
+    print(f"requests: {len(results)}  ok: {len(ok)}  errors: {sum(errors.values())} {errors or ''}")
+    print(f"throughput: {len(results) / elapsed:.1f} req/s over {elapsed:.1f}s")
+    print(f"latency ms  p50 {percentile(latencies, 50):8.1f}  p95 {percentile(latencies, 95):8.1f}  "
+          f"p99 {percentile(latencies, 99):8.1f}  max {max(latencies, default=0) * 1000:8.1f}")
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    if ttfbs:
+        print(f"ttfb ms     p50 {percentile(ttfbs, 50):8.1f}  p95 {percentile(ttfbs, 95):8.1f}  "
+              f"p99 {percentile(ttfbs, 99):8.1f}")
+    hits = sum(1 for r in ok if r["cache"] == "HIT")
+    print(f"answer cache hits: {hits}/{len(ok)}")
+
+    stage_samples = {}
+    for r in ok:
+        for name, seconds in r["stages"].items():
+            if name != "total":
+                stage_samples.setdefault(name, []).append(seconds)
+    if stage_samples:
+        print(f"\n{'stage':<18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, samples in stage_samples.items():
+            print(f"{name:<18} {len(samples):>6} {percentile(samples, 50):>9.1f} "
+                  f"{percentile(samples, 95):>9.1f} {percentile(samples, 99):>9.1f}")
+    if args.stream:
+        print("(streamed responses send headers before the first token, so chat_first_token and chat_completion are not in Server-Timing)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="SERVING_MODE for gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (WEB_CONCURRENCY)")
+    parser.add_argument("--retriever", choices=("chroma", "numpy"), help="RETRIEVER_BACKEND for the server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--stream", action="store_true", help="Request server-sent event answers")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Disable the semantic answer cache")
+    parser.add_argument("--paraphrase-rate", type=float, default=0.5,
+                        help="Fraction of questions altered so they miss the caches")
+    parser.add_argument("--seed-file", default="seed_faq.json")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--fake-port", type=int, default=0, help="Port for the fake OpenAI server (0 = any)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--verbose", action="store_true", help="Show gunicorn's stderr")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.url:
+        base_url = args.url.rstrip("/")
+        wait_until_ready(base_url, None, args.startup_timeout)
+        results, elapsed = run_load(base_url, args)
+        report(results, elapsed, args)
+        return
+
+    fake_server = serve(port=args.fake_port or free_port(), config=config_from_args(args))
+    fake_url = f"http://127.0.0.1:{fake_server.server_address[1]}/v1"
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = server_env(args, workdir, fake_url, port)
+        process = start_gunicorn(env, args.verbose, port)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"Starting gunicorn ({args.mode}, {args.workers} workers) against fake OpenAI at {fake_url}...")
+            wait_until_ready(base_url, process, args.startup_timeout)
+            results, elapsed = run_load(base_url, args)
+            report(results, elapsed, args)
+            with urllib.request.urlopen(f"{fake_url.rsplit('/v1', 1)[0]}/stats") as response:
+                print(f"\nfake OpenAI calls: {json.loads(response.read())}")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            fake_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Replays questions from query logs (QUERY_LOG_ENABLED=true, see query_log.py) to warm caches
+at deploy time and to compare latency and retrieval results between versions.
+
+Usage:
+    python benchmarks/replay_queries.py logs/queries.*.jsonl* --url http://127.0.0.1:5000
+    python benchmarks/replay_queries.py logs/queries.*.jsonl* --offline               # embedding cache + retrieval only
+    python benchmarks/replay_queries.py logs/*.jsonl --offline --output after.jsonl   # save for a later comparison
+
+--url sends every question to a running server's /api/query, which fills that server's
+embedding cache and the answer cache of whichever worker serves it (answer caches are
+in-memory, per worker); latency, status and answer cache hits are compared with the logged
+values. Replayed requests carry X-Query-Replay, so the server leaves them out of its own
+query log. --offline imports app.py in-process (same environment variables as the server:
+CHROMA_DB_PATH, EMBEDDING_CACHE_PATH, RETRIEVER_BACKEND, ...), embeds the questions in
+batches (filling the shared embedding cache) and retrieves their context, comparing the
+retrieved FAQ ids with the logged ones. No chat completions are made offline.
+
+--output writes the replayed results in the query log format, so they can be given as
+the input of a later run to compare two local versions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import send_query, wait_until_ready, percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_query_logs(paths):
+    """Query log records with a question, oldest file first as given; unreadable lines are skipped."""
+    records, skipped = [], 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                if isinstance(record, dict) and record.get("question"):
+                    records.append(record)
+    if skipped:
+        print(f"Skipped {skipped} unreadable log lines.")
+    return records
+
+
+def select_records(records, args):
+    if args.answered_only:
+        records = [r for r in records if r.get("outcome") != "error"]
+    if args.unique:
+        latest = {}
+        for record in records:
+            latest[record["question"]] = record # The most recent run of each question is the baseline
+        records = list(latest.values())
+    return records[:args.limit] if args.limit else records
+
+
+def replay_online(base_url, records, args):
+    """Sends the logged questions to a running server; returns one query log style result per record."""
+    def replay(record):
+        stream = args.stream if args.stream is not None else record.get("stream", False)
+        result = send_query(base_url, record["question"], stream, args.timeout, {"X-Query-Replay": "true"})
+        return {
+            "question": record["question"],
+            "status": result["status"],
+            "cache": result["cache"],
+            "total_ms": round(result["latency"] * 1000, 1),
+            "stages": {name: round(seconds * 1000, 1) for name, seconds in result["stages"].items() if name != "total"},
+        }
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        return list(pool.map(replay, records))
+
+
+def replay_offline(records, args):
+    """Embeds and retrieves the logged questions in-process, in batches."""
+    os.chdir(REPO_ROOT) # app.py resolves seed_faq.json and the default data paths from the repo root
+    sys.path.insert(0, REPO_ROOT)
+    import app as rag
+    from metrics import RequestTimings
+
+    if not rag.wait_for_backend(args.startup_timeout):
+        raise RuntimeError(f"Backend did not start: {rag.backend_state['error'] or rag.backend_state['status']}")
+
+    results = []
+    for start in range(0, len(records), args.batch_size):
+        batch = records[start:start + args.batch_size]
+        questions = [record["question"] for record in batch]
+        timings = [RequestTimings("replay") for _ in batch]
+
+        started = time.perf_counter()
+        question_embeddings = rag.get_embeddings(questions)
+        embedding_seconds = (time.perf_counter() - started) / len(batch)
+        started = time.perf_counter()
+        try:
+            rag.retrieve_context_batch(questions, question_embeddings, timings=timings)
+        except Exception as e:
+            print(f"Retrieval failed for questions {start + 1}-{start + len(batch)}: {e}")
+        retrieval_seconds = (time.perf_counter() - started) / len(batch)
+
+        for question, request_timings in zip(questions, timings):
+            details = request_timings.details
+            results.append({
+                "question": question,
+                "status": 200 if details.get("retrieved_ids") is not None else 500,
+                "mode": details.get("retrieval_mode"),
+                "ids": details.get("retrieved_ids"),
+                "distances": details.get("distances"),
+                "total_ms": round((embedding_seconds + retrieval_seconds) * 1000, 1),
+                "stages": {"embedding": round(embedding_seconds * 1000, 1), "retrieval": round(retrieval_seconds * 1000, 1)},
+            })
+        print(f"Replayed {min(start + args.batch_size, len(records))}/{len(records)} questions...")
+    return results
+
+
+def compare_retrieval(records, results, k):
+    """Top-1 agreement and overlap of the top-k FAQ ids, for pairs where both runs retrieved."""
+    pairs = [(r.get("ids"), res.get("ids")) for r, res in zip(records, results)]
+    pairs = [(before, after) for before, after in pairs if before is not None and after is not None]
+    if not pairs:
+        print("retrieval: no logged ids to compare (answers served from the cache skip retrieval)")
+        return
+    top1 = sum(1 for before, after in pairs if before[:1] == after[:1])
+    overlaps = [len(set(before[:k]) & set(after[:k])) / max(1, len(set(before[:k]))) for before, after in pairs]
+    changed = [(r["question"], r.get("ids")[:k], res.get("ids")[:k])
+               for r, res in zip(records, results) if r.get("ids") is not None and res.get("ids") is not None
+               and r["ids"][:k] != res["ids"][:k]]
+    print(f"retrieval: {len(pairs)} compared  top-1 agreement {top1 / len(pairs):.1%}  "
+          f"top-{k} overlap {sum(overlaps) / len(overlaps):.1%}  changed rankings {len(changed)}")
+    for question, before, after in changed[:10]:
+        print(f"  {question[:70]!r}\n    before {before}\n    after  {after}")
+
+
+def report(records, results, args):
+    def latencies(rows):
+        return [row["total_ms"] / 1000 for row in rows if row.get("status") == 200 and row.get("total_ms") is not None]
+
+    print(f"\nreplayed {len(results)} questions ({'offline' if args.offline else args.url})")
+    print(f"{'':<10} {'ok':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, rows in (("logged", records), ("replayed", results)):
+        samples = latencies(rows)
+        print(f"{label:<10} {len(samples):>6} {percentile(samples, 50):>9.1f} {percentile(samples, 95):>9.1f} "
+              f"{percentile(samples, 99):>9.1f}")
+    if args.offline:
+        print("(offline latency is embedding + retrieval per question, batched; logged latency is the full request)")
+
+    stage_names = [name for name in ("embedding", "answer_cache", "retrieval", "prompt_build", "chat_completion")
+                   if any(name in (row.get("stages") or {}) for row in results)]
+    for name in stage_names:
+        before = [r["stages"][name] / 1000 for r in records if name in (r.get("stages") or {})]
+        after = [r["stages"][name] / 1000 for r in results if name in (r.get("stages") or {})]
+        print(f"  {name:<16} p50 {percentile(before, 50):8.1f} -> {percentile(after, 50):8.1f}  "
+              f"p95 {percentile(before, 95):8.1f} -> {percentile(after, 95):8.1f}")
+
+    errors = {}
+    for result in results:
+        if result.get("status") != 200:
+            errors[result.get("status")] = errors.get(result.get("status"), 0) + 1
+    if errors:
+        print(f"errors: {errors}")
+    if args.url:
+        print(f"answer cache hits: {sum(1 for r in results if r.get('cache') == 'HIT')}/{len(results)} "
+              f"(logged: {sum(1 for r in records if r.get('cache') == 'HIT')}/{len(records)})")
+    if args.offline:
+        compare_retrieval(records, results, args.top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+", help="Query log files (rotated backups included), oldest first")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Replay against a running server")
+    target.add_argument("--offline", action="store_true", help="Replay against the retriever in this process")
+    parser.add_argument("--unique", action="store_true", help="Replay each distinct question once (cache warming)")
+    parser.add_argument("--answered-only", action="store_true", help="Skip requests that failed when logged")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many questions")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight with --url")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=None,
+                        help="Force streamed (or JSON) answers with --url; default: as logged")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions per embeddings call with --offline")
+    parser.add_argument("--top-k", type=int, default=3, help="Ranks compared between the logged and replayed ids")
+    parser.add_argument("--output", help="Write the replayed results here as query log records")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output) # --offline changes to the repo root
+
+    records = select_records(read_query_logs(args.logs), args)
+    if not records:
+        print("No questions to replay.")
+        return
+    print(f"Replaying {len(records)} questions...")
+
+    if args.url:
+        base_url = args.url.rstrip("/")
+        wait_until_ready(base_url, None, args.startup_timeout)
+        results = replay_online(base_url, records, args)
+    else:
+        results = replay_offline(records, args)
+
+    report(records, results, args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"\nWrote {len(results)} results to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
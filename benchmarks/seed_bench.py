@@ -0,0 +1,91 @@
+"""
+Measures seeding throughput (the ingest_records() path behind seed_chroma.py) against the
+local fake OpenAI server, for a grid of batch sizes and worker counts.
+
+Usage:
+    python benchmarks/seed_bench.py                                  # seed_faq.json x 20 copies
+    python benchmarks/seed_bench.py --copies 100 --batch-sizes 32,128 --workers 1,4,8
+    python benchmarks/seed_bench.py --embedding-latency 0.3 --rate-limit-rate 0.05
+
+Each run embeds into a fresh temporary Chroma collection starting from an empty embedding
+cache, then a second pass into another empty collection measures a warm-cache reseed.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_openai import serve, add_config_arguments, config_from_args
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def build_faqs(seed_file, copies):
+    """Repeats the seed FAQs with distinct questions so every copy needs its own embedding."""
+    with open(seed_file, 'r', encoding='utf-8') as f:
+        faqs = json.load(f)
+    return [dict(faq, id=f"{faq['id']}_{copy}", question=f"{faq['question']} [{copy}]")
+            for copy in range(copies) for faq in faqs]
+
+
+def run_case(openai_client, records, workdir, batch_size, max_workers, write_chunk_size):
+    import chromadb
+    from ingestion import ingest_records
+    from embedding_cache import EmbeddingCache
+
+    db_path = os.path.join(workdir, f"db_{batch_size}_{max_workers}")
+    collection = chromadb.PersistentClient(path=db_path).get_or_create_collection(name="jersey_faqs")
+    options = dict(batch_size=batch_size, max_workers=max_workers, write_chunk_size=write_chunk_size)
+
+    # Cold run: an empty cache, so every record is embedded (and the cache gets filled)
+    cache = EmbeddingCache(os.path.join(workdir, f"cache_{batch_size}_{max_workers}.sqlite3"))
+    cold = ingest_records(collection, openai_client, records, EMBEDDING_MODEL, cache=cache, **options)
+
+    # Warm reseed: the same records into a second empty collection, served from the cache
+    warm_collection = chromadb.PersistentClient(path=db_path + "_warm").get_or_create_collection(name="jersey_faqs")
+    warm = ingest_records(warm_collection, openai_client, records, EMBEDDING_MODEL, cache=cache, **options)
+    return cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed-file", default=os.path.join(REPO_ROOT, "seed_faq.json"))
+    parser.add_argument("--copies", type=int, default=20, help="Times the seed FAQs are repeated")
+    parser.add_argument("--batch-sizes", default="16,64", help="Comma-separated EMBED_BATCH_SIZE values")
+    parser.add_argument("--workers", default="1,4", help="Comma-separated EMBED_MAX_WORKERS values")
+    parser.add_argument("--write-chunk-size", type=int, default=256)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    from openai import OpenAI
+    from ingestion import prepare_faq_records
+
+    fake_server = serve(port=0, config=config_from_args(args))
+    openai_client = OpenAI(api_key="sk-fake-benchmark",
+                           base_url=f"http://127.0.0.1:{fake_server.server_address[1]}/v1")
+    records = prepare_faq_records(build_faqs(args.seed_file, args.copies))
+    print(f"Seeding {len(records)} FAQs per run against the fake OpenAI server...")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for batch_size in (int(v) for v in args.batch_sizes.split(",")):
+            for max_workers in (int(v) for v in args.workers.split(",")):
+                cold, warm = run_case(openai_client, records, workdir, batch_size, max_workers, args.write_chunk_size)
+                rows.append((batch_size, max_workers, cold, warm))
+    fake_server.shutdown()
+
+    print(f"\n{'batch':>6} {'workers':>8} {'docs':>6} {'cold s':>8} {'docs/s':>9} {'API calls':>10} "
+          f"{'retries':>8} {'failed':>7} {'warm s':>8} {'warm docs/s':>12}")
+    for batch_size, max_workers, cold, warm in rows:
+        cold_rate = cold.docs_written / cold.elapsed if cold.elapsed else 0.0
+        warm_rate = warm.docs_written / warm.elapsed if warm.elapsed else 0.0
+        print(f"{batch_size:>6} {max_workers:>8} {cold.docs_written:>6} {cold.elapsed:>8.2f} {cold_rate:>9.1f} "
+              f"{cold.api_calls:>10} {cold.retries:>8} {cold.docs_failed:>7} {warm.elapsed:>8.2f} {warm_rate:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
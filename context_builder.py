@@ -0,0 +1,187 @@
+import os
+import re
+import math
+
+try:
+    import tiktoken
+except ImportError: # Optional: without it token counts are estimated from text length
+    tiktoken = None
+
+from embedding_cache import normalize_text
+
+# --- Prompt context settings (override via environment variables) ---
+# The budget, not the candidate count, decides k: seed FAQ entries take ~55 tokens each, so 250
+# usually fits 3 (sometimes 4 short ones) plus their sources, against ~265 for the 3 wrapped
+# documents the prompt used to carry
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "250"))  # Max tokens of FAQ context per prompt
+CONTEXT_MAX_RESULTS = int(os.getenv("CONTEXT_MAX_RESULTS", "5"))      # Candidates retrieved; k is picked within the budget
+CHARS_PER_TOKEN_ESTIMATE = 4.0                                         # Fallback when tiktoken is not installed
+# Answers sharing at least this fraction of their distinct words (Jaccard) count as duplicates
+CONTEXT_DUPLICATE_OVERLAP = float(os.getenv("CONTEXT_DUPLICATE_OVERLAP", "0.9"))
+
+NO_CONTEXT_TEXT = "No specific local information found."
+
+# Static instructions, sent unchanged as the system message on every request so the prompt
+# prefix is identical across requests (and eligible for OpenAI's automatic prompt caching).
+SYSTEM_PROMPT = (
+    "You are 'Ask Jersey!', a helpful AI assistant for information about Jersey. "
+    "Answer the user's question based only on the Jersey FAQ context given with it. "
+    f"If the context is \"{NO_CONTEXT_TEXT}\" or clearly irrelevant to the question, say that you couldn't find "
+    "specific information in your current documents for this query, then answer generally if you can, "
+    "clearly indicating it's general knowledge. "
+    "Be concise and helpful. If you use information from a source in the context, you can mention it "
+    "(e.g., \"According to [source]...\")."
+)
+
+_encoding = None
+if tiktoken:
+    try:
+        _encoding = tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        print(f"Warning: Could not load tiktoken encoding, estimating token counts instead: {e}")
+
+
+def count_tokens(text):
+    """Tokens in `text` for GPT-4o (tiktoken if installed, else a ~4 characters/token estimate)."""
+    if not text:
+        return 0
+    if _encoding:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN_ESTIMATE)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts `text` to at most `max_tokens` tokens, ending with an ellipsis when shortened."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text)[:max(0, max_tokens - 1)]).rstrip() + "…"
+    return text[:max(0, int((max_tokens - 1) * CHARS_PER_TOKEN_ESTIMATE))].rstrip() + "…"
+
+
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
+USER_MESSAGE_TEMPLATE = "Context from Jersey FAQs:\n---\n{context}\n---\n\nUser's Question: {question}"
+# Tokens each prompt spends outside the FAQ context and the question
+PROMPT_OVERHEAD_TOKENS = SYSTEM_PROMPT_TOKENS + count_tokens(USER_MESSAGE_TEMPLATE.format(context="", question=""))
+
+# What the prompt used to carry, as the reference for the tokens-saved metric: the top 3 stored
+# documents, each wrapped with its source, inside an instruction block repeated in every request
+BASELINE_RESULTS = 3
+BASELINE_INSTRUCTIONS = (
+    "You are 'Ask Jersey!', a helpful AI assistant providing information about Jersey based on the context given.\n"
+    "You are 'Ask Jersey!', a helpful AI assistant for information about Jersey.\n"
+    "Answer the user's question based *only* on the provided context below.\n"
+    "If the context states \"No specific local information found.\" or if the context is clearly irrelevant to the "
+    "question, state that you couldn't find specific information in your current documents for this query, then try "
+    "to answer the question generally if you can, clearly indicating it's general knowledge.\n"
+    "Be concise and helpful. If you use information from a source in the context, you can subtly weave it in or "
+    "mention it if appropriate (e.g., \"According to [source]...\").\n\n"
+    "Context from Jersey FAQs:\n---\n\n---\n\nUser's Question: \n\nAnswer:"
+)
+BASELINE_INSTRUCTION_TOKENS = count_tokens(BASELINE_INSTRUCTIONS)
+
+
+def baseline_tokens(retrieved_documents, retrieved_metadatas):
+    """Tokens the old prompt format would have used for these hits (excluding the question)."""
+    wrapped = []
+    for i, document in enumerate(retrieved_documents[:BASELINE_RESULTS]):
+        metadata = (retrieved_metadatas[i] if i < len(retrieved_metadatas) else None) or {}
+        wrapped.append(f"Context (Source: {metadata.get('source') or 'N/A'}):\n{document}")
+    return BASELINE_INSTRUCTION_TOKENS + count_tokens("\n\n".join(wrapped) if wrapped else NO_CONTEXT_TEXT)
+
+
+def format_entry(document, metadata, source_tag=None):
+    """
+    Compact context entry from FAQ metadata; falls back to the stored document when fields are
+    missing. The source is referenced by `source_tag` (e.g. "[S1]"); URLs are listed once, after the entries.
+    """
+    question = (metadata or {}).get('question')
+    answer = (metadata or {}).get('answer')
+    text = f"Q: {question}\nA: {answer}" if question and answer else (document or "")
+    return f"{text} {source_tag}" if source_tag else text
+
+
+def format_sources(sources):
+    """Footer listing each distinct source URL once, with the tag its entries use."""
+    return "Sources: " + "; ".join(f"[S{n}] {source}" for n, source in enumerate(sources, 1))
+
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _overlap_key(document, metadata):
+    """Distinct words of the answer (or document), for near-duplicate detection."""
+    answer = (metadata or {}).get('answer') or document or ""
+    return frozenset(_WORD_PATTERN.findall(normalize_text(answer).casefold()))
+
+
+def _is_duplicate(key, other):
+    """True if two answers' word sets overlap by at least CONTEXT_DUPLICATE_OVERLAP."""
+    return len(key & other) >= CONTEXT_DUPLICATE_OVERLAP * len(key | other)
+
+
+class PromptContext:
+    """The context chosen for one prompt, with the token accounting reported in the metrics."""
+
+    def __init__(self, text, entries, tokens, baseline_tokens, duplicates, truncated):
+        self.text = text
+        self.entries = entries                  # Number of FAQ entries included (the adaptive k)
+        self.tokens = tokens                    # Tokens of context actually sent
+        self.baseline_tokens = baseline_tokens  # Tokens the old prompt format would have used (see baseline_tokens())
+        self.duplicates = duplicates            # Hits skipped as duplicates of an included entry
+        self.truncated = truncated              # True if the single included entry was cut to fit
+
+    @property
+    def prompt_tokens(self):
+        """Tokens of the whole prompt except the question: instructions, wrapper and context."""
+        return PROMPT_OVERHEAD_TOKENS + self.tokens
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.baseline_tokens - self.prompt_tokens)
+
+
+def build_context(retrieved_documents, retrieved_metadatas, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Picks context entries in retrieval order (best first): duplicate or near-duplicate answers
+    are skipped, entries use the compact question/answer fields with a short source tag, and
+    entries are added until the next one (with its source, if new) would exceed `token_budget`.
+    If even the best entry is too long it is truncated to the budget rather than dropped.
+    """
+    entries, seen, sources = [], [], []
+    used_tokens = duplicates = 0
+    truncated = False
+    for i, document in enumerate(retrieved_documents):
+        metadata = retrieved_metadatas[i] if i < len(retrieved_metadatas) else {}
+        key = _overlap_key(document, metadata)
+        if key and any(_is_duplicate(key, other) for other in seen):
+            duplicates += 1
+            continue
+        source = (metadata or {}).get('source')
+        new_source = bool(source) and source not in sources
+        source_tag = f"[S{(sources.index(source) if source in sources else len(sources)) + 1}]" if source else None
+        entry = format_entry(document, metadata, source_tag)
+        entry_tokens = count_tokens(entry) + 2 # Separator between entries
+        source_tokens = count_tokens(f"; {source_tag} {source}") if new_source else 0
+        if used_tokens + entry_tokens + source_tokens > token_budget:
+            if entries:
+                continue # Keep looking: a shorter, lower-ranked entry may still fit
+            entry = truncate_to_tokens(entry, max(1, token_budget - source_tokens))
+            entry_tokens = count_tokens(entry)
+            truncated = True
+        entries.append(entry)
+        seen.append(key)
+        if new_source:
+            sources.append(source)
+        used_tokens += entry_tokens + source_tokens
+
+    text = "\n\n".join(entries) if entries else NO_CONTEXT_TEXT
+    if sources:
+        text += "\n\n" + format_sources(sources)
+    return PromptContext(text, len(entries), count_tokens(text),
+                         baseline_tokens(retrieved_documents, retrieved_metadatas), duplicates, truncated)
+
+
+def build_user_message(user_question, context):
+    return {"role": "user", "content": USER_MESSAGE_TEMPLATE.format(context=context.text, question=user_question)}
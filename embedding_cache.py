@@ -0,0 +1,145 @@
+import os
+import array
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# --- Embedding cache settings (override via environment variables) ---
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "4096"))  # In-memory LRU entries
+
+
+def normalize_text(text):
+    """Normalizes text before hashing so trivial whitespace/Unicode differences share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model, text):
+    """Content address for an embedding: sha256 over the model name and the normalized text."""
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (model, hash of normalized text).
+    An in-memory LRU sits in front of a SQLite file so the cache survives restarts
+    and is shared by the app, its gunicorn workers and seed_chroma.py.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_size=EMBEDDING_CACHE_MEMORY_SIZE):
+        self.path = path
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # One connection shared across threads, serialized by self._lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Lets several processes read while one writes
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    # --- In-memory LRU helpers (caller holds self._lock) ---
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _encode(embedding):
+        return array.array("f", embedding).tobytes()
+
+    @staticmethod
+    def _decode(blob):
+        vector = array.array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def get_many(self, model, texts):
+        """Returns a list aligned with `texts` holding cached embeddings, or None for misses."""
+        keys = [cache_key(model, t) for t in texts]
+        results = [None] * len(texts)
+        disk_lookups = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = embedding
+                    self.memory_hits += 1
+                else:
+                    disk_lookups.setdefault(key, []).append(i)
+
+            if disk_lookups:
+                lookup_keys = list(disk_lookups)
+                # Stay well under SQLite's bound-parameter limit.
+                for start in range(0, len(lookup_keys), 500):
+                    chunk = lookup_keys[start:start + 500]
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = self._decode(blob)
+                        self._remember(key, embedding)
+                        for i in disk_lookups[key]:
+                            results[i] = embedding
+
+            found = sum(1 for r in results if r is not None)
+            self.hits += found
+            self.misses += len(texts) - found
+        return results
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, embeddings):
+        """Stores embeddings for `texts` (same order) in memory and on disk."""
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                if not embedding:
+                    continue
+                key = cache_key(model, text)
+                self._remember(key, list(embedding))
+                rows.append((key, model, self._encode(embedding)))
+            if rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)", rows
+                )
+                self._conn.commit()
+                self.writes += len(rows)
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def stats(self):
+        """Hit/miss counters for this process, plus current cache sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.hits - self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "writes": self.writes,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+
+# Gunicorn settings for both serving modes. Select with SERVING_MODE:
+#   sync  (default) - Flask WSGI app on threaded (gthread) workers; GUNICORN_THREADS questions per worker.
+#   async           - ASGI app (asgi.py) on uvicorn workers; many questions in flight per worker.
+# Bind address and worker count follow gunicorn's usual PORT / WEB_CONCURRENCY environment variables.
+SERVING_MODE = os.getenv("SERVING_MODE", "sync").lower()
+
+if SERVING_MODE == "async":
+    wsgi_app = "asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    # The async admission queue is not bound by threads: admit as many questions as can be in an
+    # OpenAI call or a blocking-pool job at once, and queue what those slots drain within the
+    # queue timeout (QUERY_QUEUE_TIMEOUT_SECONDS) at a couple of seconds per answer
+    async_slots = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64")) + int(os.getenv("ASYNC_BLOCKING_POOL_SIZE", "32"))
+    os.environ.setdefault("ASYNC_QUERY_MAX_CONCURRENCY", str(async_slots))
+    os.environ.setdefault("ASYNC_QUERY_MAX_QUEUE", str(async_slots * 4))
+else:
+    wsgi_app = "app:app"
+    # Threads let a worker hold several questions while they wait on OpenAI, which is what gives
+    # in-process query coalescing and the admission queue (app.query_admission) requests to act on;
+    # with a single thread each worker sees one request at a time. Set to 1 for plain sync workers.
+    threads = int(os.getenv("GUNICORN_THREADS", "32"))
+    # Admission limits inside the thread count, so overload gets a fast 503 while threads remain
+    # for waiting followers and other routes, instead of piling up on gunicorn's connection backlog
+    os.environ.setdefault("QUERY_MAX_CONCURRENCY", str(max(1, threads // 2)))
+    os.environ.setdefault("QUERY_MAX_QUEUE", str(threads // 4))
+
+# Streaming answers can stay open for as long as GPT-4o takes to finish.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Seed once, in the master, before any worker starts: seed_chroma.py runs as a subprocess (the
+# master never opens Chroma, whose clients are not fork-safe) and workers then skip the FAQ sync
+# and attach to the collection lazily, so booting or adding a worker costs little more than
+# importing Flask. Set GUNICORN_SEED_ON_START=false to leave syncing to the workers (they
+# serialize it with a lock file) or when seeding is a separate deploy step.
+SEED_ON_START = os.getenv("GUNICORN_SEED_ON_START", "true").lower() in ("1", "true", "yes")
+os.environ.setdefault("STARTUP_MODE", "lazy")
+
+
+def on_starting(server):
+    if not SEED_ON_START or os.getenv("FAQ_SYNC_MODE", "incremental").lower() != "incremental":
+        return
+    server.log.info("Syncing seed FAQs into ChromaDB before starting workers...")
+    result = subprocess.run([sys.executable, "seed_chroma.py"], cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode == 0:
+        os.environ["FAQ_SYNC_MODE"] = "off" # Inherited by the workers
+    else:
+        server.log.warning("Seeding failed (exit code %s); workers will sync on startup.", result.returncode)
@@ -0,0 +1,582 @@
+import os
+import json
+import hashlib
+import time
+import random
+import threading
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import fcntl
+except ImportError: # Windows: seeding is not serialized across processes
+    fcntl = None
+
+import openai
+
+# --- Ingestion tuning (override via environment variables) ---
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))           # FAQs per embeddings.create call
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))          # Batches in flight at once
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))          # Retries per batch on transient errors
+EMBED_RETRY_BASE_DELAY = float(os.getenv("EMBED_RETRY_BASE_DELAY", "0.5"))  # Seconds, doubled per attempt
+EMBED_RETRY_MAX_DELAY = float(os.getenv("EMBED_RETRY_MAX_DELAY", "20"))
+CHROMA_WRITE_CHUNK_SIZE = int(os.getenv("CHROMA_WRITE_CHUNK_SIZE", "256"))  # Records per collection.add
+INGEST_STREAM_CHUNK_SIZE = int(os.getenv("INGEST_STREAM_CHUNK_SIZE", "1024"))  # Records held in memory per streamed chunk
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "1500"))        # Longer answers are split into passages; 0 = never
+PASSAGE_OVERLAP_CHARS = int(os.getenv("PASSAGE_OVERLAP_CHARS", "200")) # Text repeated from the end of the previous passage
+
+# Collection metadata key bumped on every write, so readers (e.g. the answer cache) can detect changes.
+COLLECTION_VERSION_KEY = "faq_version"
+# Collection metadata key holding the hash of the seed file last synced, so unchanged files are skipped.
+SEED_HASH_KEY = "seed_hash"
+# Per-record metadata keys used by incremental sync.
+CONTENT_HASH_KEY = "content_hash"      # Hash of the fields that feed the document/metadata
+INGEST_SOURCE_KEY = "ingest_source"    # File the record was synced from; sync only deletes its own records
+# Lock file inside the Chroma directory, held while seeding so only one process embeds and writes at a time.
+SEED_LOCK_FILE = ".seed.lock"
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses.
+TRANSIENT_OPENAI_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class IngestionReport:
+    """Counters collected during an ingestion run, printed as a timing report at the end."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.docs_total = 0
+        self.docs_written = 0
+        self.docs_failed = 0
+        self.api_calls = 0
+        self.retries = 0
+        self.chroma_writes = 0
+        self.cache_hits = 0
+        self.docs_unchanged = 0
+        self.docs_deleted = 0
+
+    def incr(self, counter, amount=1):
+        """Thread-safe increment, since embedding batches report from worker threads."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def summary(self):
+        elapsed = self.elapsed
+        docs_per_sec = self.docs_written / elapsed if elapsed > 0 else 0.0
+        return (
+            f"Ingestion report: {self.docs_written}/{self.docs_total} docs written in {elapsed:.2f}s "
+            f"({docs_per_sec:.1f} docs/sec), {self.api_calls} embedding API calls, "
+            f"{self.cache_hits} embedding cache hits, "
+            f"{self.retries} retries, {self.docs_failed} failed, {self.chroma_writes} Chroma writes, "
+            f"{self.docs_unchanged} unchanged, {self.docs_deleted} deleted."
+        )
+
+
+def update_collection_metadata(collection, **values):
+    """Merges `values` into the collection metadata, keeping existing keys."""
+    try:
+        metadata = dict(collection.metadata or {})
+        metadata.update(values)
+        collection.modify(metadata=metadata)
+    except Exception as e:
+        print(f"  Warning: Could not update metadata {list(values)} on collection '{collection.name}': {e}")
+
+
+def mark_collection_changed(collection, **extra_metadata):
+    """Stores a fresh version token (plus any extra metadata) in the collection after its contents change."""
+    update_collection_metadata(collection, **{COLLECTION_VERSION_KEY: uuid.uuid4().hex}, **extra_metadata)
+
+
+def get_collection_version(collection):
+    """Returns the version token stored by mark_collection_changed(), or None if never set."""
+    return (collection.metadata or {}).get(COLLECTION_VERSION_KEY)
+
+
+@contextmanager
+def seed_lock(db_path):
+    """
+    Exclusive inter-process lock around seeding the Chroma directory at `db_path`, so gunicorn
+    workers and seed_chroma.py never sync the same collection concurrently. Blocks until held.
+    Open collection handles after acquiring it: older handles miss metadata written meanwhile.
+    """
+    if not os.path.exists(db_path):
+        os.makedirs(db_path)
+    with open(os.path.join(db_path, SEED_LOCK_FILE), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_sha256(path):
+    """Hash of a file's bytes, used to skip syncing an unchanged seed file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(document, metadata):
+    """Hash of everything stored for a record except the hash itself and bookkeeping keys."""
+    payload = {k: v for k, v in metadata.items() if k not in (CONTENT_HASH_KEY, INGEST_SOURCE_KEY)}
+    payload["document"] = document
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def load_faq_file(path='seed_faq.json'):
+    """Reads the FAQ list from a JSON file. Raises the usual file/JSON errors to the caller."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _iter_json_array(f, buffer, block_size):
+    """Yields the items of a JSON array whose opening '[' has been consumed, decoding one item at a time."""
+    decoder = json.JSONDecoder()
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number cut by the block boundary still decodes ("123" of "12345", "-5" of "-5.0"):
+                # unless a delimiter follows it in the buffer, read more before trusting it
+                if eof or buffer[end:].lstrip("0123456789+-.eE"):
+                    yield item
+                    buffer = buffer[end:]
+                    continue
+        elif eof:
+            raise json.JSONDecodeError("Unterminated JSON array", "", 0)
+        block = f.read(block_size) # Item incomplete (or buffer empty): read more
+        eof = not block
+        buffer += block
+
+
+def iter_faq_file(path, block_size=1 << 16):
+    """
+    Yields FAQ dicts one at a time from a JSON array file or a JSONL file (one object per
+    line), reading incrementally so memory stays flat however large the file is.
+    Raises the usual file/JSON errors to the caller.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(block_size).lstrip()
+        if head.startswith('['):
+            yield from _iter_json_array(f, head[1:], block_size)
+            return
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def split_passages(text, max_chars=PASSAGE_MAX_CHARS, overlap=PASSAGE_OVERLAP_CHARS):
+    """
+    Splits `text` into passages of at most `max_chars`, breaking at a paragraph, line,
+    sentence or word boundary where possible. Each passage after the first starts with the
+    last ~`overlap` characters of the previous one. Short text is returned as one passage.
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    overlap = max(0, min(overlap, max_chars // 4)) # Keeps every step at least max_chars / 4 forward
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + max_chars)
+        if end < len(text):
+            window = text[start:end]
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = window.rfind(separator, max_chars // 2)
+                if cut != -1:
+                    end = start + cut + len(separator)
+                    break
+        passages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = end - overlap
+        word_start = text.find(" ", next_start, end) # Don't start a passage mid-word
+        start = word_start + 1 if overlap and word_start != -1 else next_start
+    return [p for p in passages if p]
+
+
+def faq_to_records(faq_item, passage_max_chars=PASSAGE_MAX_CHARS):
+    """
+    Records for one valid FAQ dict: a single record, or one per passage when the answer is
+    longer than `passage_max_chars`. Passage records get the ID "<faq id>#<n>" and carry
+    parent_id / passage_index / passage_count metadata; each repeats the question.
+    """
+    question = faq_item['question']
+    source = faq_item.get('source', '')
+    category = faq_item.get('category', '')
+    passages = split_passages(faq_item['answer'], passage_max_chars)
+
+    records = []
+    for index, answer in enumerate(passages):
+        document = f"Question: {question}\nAnswer: {answer}"
+        metadata = {
+            "question": question,
+            "answer": answer,
+            "source": source,
+            "category": category
+        }
+        record_id = str(faq_item['id'])
+        if len(passages) > 1:
+            metadata.update(parent_id=record_id, passage_index=index, passage_count=len(passages))
+            record_id = f"{record_id}#{index}"
+        metadata[CONTENT_HASH_KEY] = content_hash(document, metadata)
+        records.append({"id": record_id, "document": document, "metadata": metadata})
+    return records
+
+
+def iter_faq_records(faqs, passage_max_chars=PASSAGE_MAX_CHARS, processed_ids=None):
+    """
+    Validates and de-duplicates raw FAQ dicts, yielding (item index, records for that FAQ).
+    Invalid and duplicate entries are skipped with a warning (and yield an empty list, so
+    callers can still count the item as consumed).
+    """
+    processed_ids = set() if processed_ids is None else processed_ids
+    for index, faq_item in enumerate(faqs):
+        faq_id = faq_item.get('id') if isinstance(faq_item, dict) else None
+        if not faq_id or not faq_item.get('question') or not faq_item.get('answer'):
+            print(f"  Skipping FAQ due to missing id, question, or answer: {faq_item}")
+            yield index, []
+            continue
+
+        faq_id_str = str(faq_id) # Ensure ID is a string for ChromaDB
+
+        if faq_id_str in processed_ids:
+            print(f"  Warning: Duplicate FAQ ID '{faq_id_str}' found. Skipping.")
+            yield index, []
+            continue
+        processed_ids.add(faq_id_str)
+        yield index, faq_to_records(faq_item, passage_max_chars)
+
+
+def prepare_faq_records(faqs, passage_max_chars=PASSAGE_MAX_CHARS):
+    """
+    Validates and de-duplicates raw FAQ dicts and returns a list of records ready for embedding:
+    {"id", "document", "metadata"}. Invalid and duplicate entries are skipped with a warning.
+    Answers longer than `passage_max_chars` become several passage records.
+    """
+    return [record for _, records in iter_faq_records(faqs, passage_max_chars) for record in records]
+
+
+def _retry_delay(attempt):
+    """Exponential backoff with full jitter, capped at EMBED_RETRY_MAX_DELAY."""
+    return random.uniform(0, min(EMBED_RETRY_MAX_DELAY, EMBED_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def embed_texts_with_retry(openai_client, texts, model, report=None, max_retries=EMBED_MAX_RETRIES):
+    """
+    Embeds a list of texts in a single embeddings.create call, retrying transient failures
+    with backoff. Returns embeddings in the same order as `texts`.
+    """
+    attempt = 0
+    while True:
+        try:
+            if report is not None:
+                report.incr("api_calls")
+            response = openai_client.embeddings.create(input=texts, model=model)
+            # The API returns one item per input; sort by index to be safe about ordering.
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        except TRANSIENT_OPENAI_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_delay(attempt)
+            attempt += 1
+            if report is not None:
+                report.incr("retries")
+            print(f"  Transient embedding error ({type(e).__name__}), retry {attempt}/{max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def _write_chunk(collection, chunk, report, upsert=False):
+    """Adds (or upserts) one chunk of embedded records to the collection in a single call."""
+    write = collection.upsert if upsert else collection.add
+    try:
+        write(
+            ids=[r["id"] for r in chunk],
+            documents=[r["document"] for r in chunk],
+            metadatas=[r["metadata"] for r in chunk],
+            embeddings=[r["embedding"] for r in chunk]
+        )
+        report.docs_written += len(chunk)
+        report.chroma_writes += 1
+    except Exception as e:
+        print(f"  Error adding {len(chunk)} documents to Chroma: {e}")
+        report.docs_failed += len(chunk)
+
+
+def _flush(collection, pending, report, write_chunk_size, final=False, upsert=False):
+    """Writes full chunks from the `pending` buffer (and the remainder too when `final`)."""
+    write_chunk_size = max(1, write_chunk_size)
+    while len(pending) >= write_chunk_size or (final and pending):
+        chunk = pending[:write_chunk_size]
+        del pending[:write_chunk_size]
+        _write_chunk(collection, chunk, report, upsert)
+
+
+def ingest_records(collection, openai_client, records, model,
+                   batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS,
+                   write_chunk_size=CHROMA_WRITE_CHUNK_SIZE, cache=None, upsert=False, report=None,
+                   mark_changed=True):
+    """
+    Embeds `records` (from prepare_faq_records) in multi-item batches, running up to
+    `max_workers` batches concurrently, and writes them to `collection` in chunks as
+    batches complete (with collection.upsert when `upsert`, else collection.add).
+    Documents already in `cache` (an EmbeddingCache) are not sent to the API, and FAQ
+    questions missing from it are embedded in the same calls (see missing_questions()).
+    Bumps the collection version afterwards unless `mark_changed` is False.
+    Returns an IngestionReport.
+    """
+    report = report or IngestionReport()
+    report.docs_total += len(records)
+    pending = []
+
+    to_embed = records
+    questions = [] # FAQ questions missing from the cache, embedded in the same calls as the documents
+    if cache is not None:
+        cached = cache.get_many(model, [r["document"] for r in records])
+        to_embed = []
+        for record, embedding in zip(records, cached):
+            if embedding is not None:
+                pending.append(dict(record, embedding=embedding))
+                report.cache_hits += 1
+            else:
+                to_embed.append(record)
+        _flush(collection, pending, report, write_chunk_size, upsert=upsert)
+        questions = missing_questions(records, model, cache)
+
+    # Batches hold records (embedded by their document) followed by question strings
+    items = to_embed + questions
+    batch_size = max(1, batch_size)
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def texts_of(batch):
+        return [item if isinstance(item, str) else item["document"] for item in batch]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(embed_texts_with_retry, openai_client, texts_of(batch), model, report): batch
+            for batch in batches
+        }
+        # Chroma writes stay on this thread; only the OpenAI round trips run concurrently.
+        for future in as_completed(futures):
+            batch = futures[future]
+            batch_records = [item for item in batch if not isinstance(item, str)]
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                if batch_records:
+                    print(f"  Error embedding batch of {len(batch_records)} FAQs (first ID: {batch_records[0]['id']}): {e}")
+                    report.docs_failed += len(batch_records)
+                else:
+                    print(f"  Error embedding {len(batch)} FAQ questions for the direct-answer gate: {e}")
+                continue
+
+            if cache is not None:
+                cache.put_many(model, texts_of(batch), embeddings)
+
+            for record, embedding in zip(batch, embeddings):
+                if isinstance(record, str):
+                    continue # A question: only needed in the cache
+                if embedding:
+                    pending.append(dict(record, embedding=embedding))
+                else:
+                    print(f"  Skipping FAQ ID: {record['id']} due to empty embedding.")
+                    report.docs_failed += 1
+
+            _flush(collection, pending, report, write_chunk_size, upsert=upsert)
+
+    _flush(collection, pending, report, write_chunk_size, final=True, upsert=upsert)
+    if report.docs_written and mark_changed:
+        mark_collection_changed(collection)
+    report.finish()
+    return report
+
+
+def missing_questions(records, model, cache):
+    """
+    The distinct FAQ questions of `records` not yet in `cache`. They are embedded into the
+    cache alongside the documents (not written to Chroma): the direct-answer gate compares a
+    user's question with FAQ questions alone and reads them from the cache on the query path.
+    """
+    questions = list(dict.fromkeys(r["metadata"]["question"] for r in records if r["metadata"].get("question")))
+    cached = cache.get_many(model, questions)
+    return [question for question, embedding in zip(questions, cached) if embedding is None]
+
+
+def sync_records(collection, openai_client, records, model, source_name, cache=None, source_hash=None, **ingest_options):
+    """
+    Incrementally syncs `records` from the file `source_name` into `collection`: records whose
+    content hash is new or changed are embedded and upserted, records previously synced from
+    the same file but no longer present are deleted, and unchanged records are left alone.
+    Records written before sync existed (no ingest_source) count as belonging to this file.
+    Returns an IngestionReport.
+    """
+    report = IngestionReport()
+
+    existing = collection.get(include=["metadatas"])
+    existing_hashes = {}
+    for record_id, metadata in zip(existing.get('ids') or [], existing.get('metadatas') or []):
+        metadata = metadata or {}
+        if metadata.get(INGEST_SOURCE_KEY, source_name) == source_name:
+            existing_hashes[record_id] = metadata.get(CONTENT_HASH_KEY)
+
+    changed = []
+    for record in records:
+        record["metadata"][INGEST_SOURCE_KEY] = source_name
+        if existing_hashes.get(record["id"]) == record["metadata"][CONTENT_HASH_KEY]:
+            report.docs_unchanged += 1
+        else:
+            changed.append(record)
+    current_ids = {r["id"] for r in records}
+    removed_ids = [record_id for record_id in existing_hashes if record_id not in current_ids]
+
+    print(f"  Sync plan for '{source_name}': {len(changed)} new/changed, "
+          f"{report.docs_unchanged} unchanged, {len(removed_ids)} removed.")
+
+    if changed:
+        ingest_records(collection, openai_client, changed, model, cache=cache, upsert=True,
+                       report=report, **ingest_options)
+        # ingest_records already bumped the version marker if anything was written
+
+    for start in range(0, len(removed_ids), CHROMA_WRITE_CHUNK_SIZE):
+        chunk = removed_ids[start:start + CHROMA_WRITE_CHUNK_SIZE]
+        try:
+            collection.delete(ids=chunk)
+            report.docs_deleted += len(chunk)
+        except Exception as e:
+            print(f"  Error deleting {len(chunk)} removed FAQs from Chroma: {e}")
+            report.docs_failed += len(chunk) # Keeps the file hash unset, so the delete is retried next run
+
+    if report.docs_deleted:
+        mark_collection_changed(collection)
+    # Only remember the file hash when everything was applied, so failures are retried next run
+    if source_hash and not report.docs_failed:
+        update_collection_metadata(collection, **{SEED_HASH_KEY: source_hash})
+
+    report.finish()
+    return report
+
+
+def _file_identity(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def load_checkpoint(checkpoint_path, source_path):
+    """Returns the number of source items already ingested, or 0 if there is no usable checkpoint."""
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"  Warning: Ignoring unreadable checkpoint '{checkpoint_path}': {e}")
+        return 0
+    if checkpoint.get("source") != _file_identity(source_path):
+        print(f"  {source_path} changed since checkpoint '{checkpoint_path}' was written. Starting from the beginning.")
+        return 0
+    return int(checkpoint.get("items_done", 0))
+
+
+def save_checkpoint(checkpoint_path, source_path, items_done, report):
+    """Records progress atomically (temporary file + rename), so a crash never leaves a torn checkpoint."""
+    checkpoint_tmp = f"{checkpoint_path}.{os.getpid()}.tmp"
+    with open(checkpoint_tmp, 'w', encoding='utf-8') as f:
+        json.dump({"source": _file_identity(source_path), "items_done": items_done,
+                   "docs_written": report.docs_written, "updated_at": time.time()}, f)
+    os.replace(checkpoint_tmp, checkpoint_path)
+
+
+def ingest_stream(collection, openai_client, path, model, source_name=None, cache=None,
+                  checkpoint_path=None, resume=True, chunk_size=INGEST_STREAM_CHUNK_SIZE,
+                  passage_max_chars=PASSAGE_MAX_CHARS, mark_changed=True, **ingest_options):
+    """
+    Streams FAQs from a JSON array or JSONL file at `path` into `collection` with bounded
+    memory: items are parsed one at a time, long answers are split into passages, and about
+    `chunk_size` records at a time are embedded and upserted (see ingest_records). After
+    each chunk is written, the number of source items consumed is saved to `checkpoint_path`
+    (default: `<path>.checkpoint.json`); a later run with `resume` skips those items. The
+    run stops at the first chunk with failed records, leaving the checkpoint before that
+    chunk so rerunning retries it. The checkpoint is deleted once the whole file is in.
+
+    Records are tagged with `source_name` (default: the file name) like sync_records(),
+    but nothing is deleted: records missing from the file stay in the collection. With
+    `mark_changed` false the caller stores the new collection version itself (e.g. under
+    seed_lock, with a fresh collection handle). Returns an IngestionReport.
+    """
+    source_name = source_name or os.path.basename(path)
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint.json"
+    items_done = load_checkpoint(checkpoint_path, path) if resume else 0
+    if items_done:
+        print(f"  Resuming '{source_name}' after {items_done} items (checkpoint '{checkpoint_path}').")
+
+    report = IngestionReport()
+    chunk = []
+    consumed = items_done
+    processed_ids = set() # Only IDs outlive a chunk (for de-duplication); documents and embeddings do not
+
+    def write_chunk():
+        failed_before = report.docs_failed
+        ingest_records(collection, openai_client, chunk, model, cache=cache, upsert=True,
+                       report=report, mark_changed=False, **ingest_options)
+        chunk.clear()
+        if report.docs_failed > failed_before:
+            return False
+        save_checkpoint(checkpoint_path, path, consumed, report)
+        print(f"  {consumed} items ingested ({report.docs_written} docs written, {report.elapsed:.1f}s).")
+        return True
+
+    completed = True
+    for index, records in iter_faq_records(iter_faq_file(path), passage_max_chars, processed_ids):
+        if index < items_done:
+            continue # Ingested by an earlier run; iter_faq_records() still remembers its ID
+        for record in records:
+            record["metadata"][INGEST_SOURCE_KEY] = source_name
+        chunk.extend(records)
+        consumed = index + 1
+        if len(chunk) >= chunk_size and not write_chunk():
+            completed = False
+            break
+    if completed and chunk:
+        completed = write_chunk()
+
+    if report.docs_written and mark_changed:
+        mark_collection_changed(collection)
+    if completed:
+        try:
+            os.remove(checkpoint_path)
+        except FileNotFoundError:
+            pass
+    else:
+        print(f"  Stopped at a chunk with {report.docs_failed} failed docs. Rerun to resume from the last checkpoint.")
+    report.finish()
+    return report
+
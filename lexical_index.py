@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import math
+import unicodedata
+
+from ingestion import get_collection_version
+
+# --- Lexical (BM25) index settings (override via environment variables) ---
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./db_lexical")
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "1.0"))  # BM25 score below which a hit is ignored
+BM25_K1 = 1.5
+BM25_B = 0.75
+QUESTION_FIELD_WEIGHT = 2 # FAQ question terms count this many times, so a matching question outranks a passing mention
+
+STOPWORDS = frozenset("""
+a about an and are as at be by can do does for from how i if in is it its me my of on or
+should that the their there this to was what when where which who why will with you your
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords; a trailing plural 's' is dropped so 'rates' matches 'rate'."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text or "").casefold()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the FAQ questions and answers, for keyword matching without an
+    embeddings call. Built from the Chroma collection after ingestion and saved as
+    `bm25.json` in LEXICAL_INDEX_PATH, tagged with the collection version it was built from.
+
+    query() returns the same per-query dict shape as the retrievers, with "scores" (BM25,
+    higher is better) in place of "distances".
+    """
+
+    name = "bm25"
+    INDEX_FILE = "bm25.json"
+
+    def __init__(self, ids, documents, metadatas, postings, doc_lengths, version=None):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.postings = postings        # term -> [[row, term frequency], ...]
+        self.doc_lengths = doc_lengths  # Tokens per row
+        self.version = version
+        self.avg_doc_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _row_tokens(document, metadata):
+        question = (metadata or {}).get('question')
+        answer = (metadata or {}).get('answer')
+        if question and answer:
+            return tokenize(question) * QUESTION_FIELD_WEIGHT + tokenize(answer)
+        return tokenize(document)
+
+    @classmethod
+    def from_records(cls, ids, documents, metadatas, version=None):
+        postings, doc_lengths = {}, []
+        for row, document in enumerate(documents):
+            tokens = cls._row_tokens(document, metadatas[row] if row < len(metadatas) else None)
+            doc_lengths.append(len(tokens))
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                postings.setdefault(token, []).append([row, frequency])
+        return cls(ids, documents, metadatas, postings, doc_lengths, version)
+
+    @classmethod
+    def build_from_collection(cls, collection, path=LEXICAL_INDEX_PATH):
+        """Indexes every document in a Chroma collection and writes the index to `path`."""
+        results = collection.get(include=["documents", "metadatas"])
+        index = cls.from_records(results.get('ids') or [], results.get('documents') or [],
+                                 results.get('metadatas') or [], get_collection_version(collection))
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # Per-process temporary name then rename, as for the NumPy index
+        index_tmp = os.path.join(path, f"bm25.{os.getpid()}.tmp.json")
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": index.version,
+                "ids": index.ids,
+                "documents": index.documents,
+                "metadatas": index.metadatas,
+                "postings": index.postings,
+                "doc_lengths": index.doc_lengths,
+            }, f)
+        os.replace(index_tmp, os.path.join(path, cls.INDEX_FILE))
+        return index
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        with open(os.path.join(path, cls.INDEX_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["ids"], data["documents"], data["metadatas"], data["postings"],
+                   data["doc_lengths"], data.get("version"))
+
+    @classmethod
+    def load_current(cls, collection, path=LEXICAL_INDEX_PATH):
+        """Loads the index if it exists and matches the collection's current version, otherwise None."""
+        try:
+            index = cls.load(path)
+        except FileNotFoundError:
+            return None
+        if index.version == get_collection_version(collection) and len(index) == collection.count():
+            return index
+        return None
+
+    @classmethod
+    def load_or_build(cls, collection, path=LEXICAL_INDEX_PATH):
+        """Loads the index if it matches the collection's current version, otherwise rebuilds it."""
+        index = cls.load_current(collection, path)
+        if index is not None:
+            return index
+        print(f"Lexical index at '{path}' is missing or stale. Building from collection '{collection.name}'...")
+        return cls.build_from_collection(collection, path)
+
+    def score(self, query_text):
+        """BM25 score per row for the query's terms; rows matching no term are absent."""
+        scores = {}
+        total = len(self)
+        for token in set(tokenize(query_text)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[row] / (self.avg_doc_length or 1.0)
+                scores[row] = scores.get(row, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return scores
+
+    def query(self, query_texts, n_results=3, min_score=LEXICAL_MIN_SCORE):
+        per_query = []
+        for query_text in query_texts:
+            ranked = sorted(((s, row) for row, s in self.score(query_text).items() if s >= min_score),
+                            key=lambda item: (-item[0], item[1]))[:n_results]
+            per_query.append({
+                "ids": [self.ids[row] for _, row in ranked],
+                "documents": [self.documents[row] for _, row in ranked],
+                "metadatas": [self.metadatas[row] for _, row in ranked],
+                "scores": [score for score, _ in ranked],
+            })
+        return per_query
+
+
+def fuse_results(vector_results, lexical_results, n_results, rrf_k=60, lexical_weight=1.0):
+    """
+    Reciprocal rank fusion of one query's vector and lexical hits. Returns the retriever
+    result shape; hits found only by the lexical index have a distance of None, since they
+    were never compared with the question embedding.
+    """
+    fused = {}
+    for rank, faq_id in enumerate(vector_results["ids"]):
+        fused[faq_id] = {"score": 1.0 / (rrf_k + rank + 1), "source": (vector_results, rank)}
+    for rank, faq_id in enumerate(lexical_results["ids"]):
+        entry = fused.setdefault(faq_id, {"score": 0.0, "source": None})
+        entry["score"] += lexical_weight / (rrf_k + rank + 1)
+        if entry["source"] is None:
+            entry["source"] = (lexical_results, rank)
+
+    merged = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    for faq_id, entry in sorted(fused.items(), key=lambda item: -item[1]["score"])[:n_results]:
+        results, rank = entry["source"]
+        merged["ids"].append(faq_id)
+        merged["documents"].append(results["documents"][rank])
+        merged["metadatas"].append(results["metadatas"][rank])
+        merged["distances"].append(results["distances"][rank] if "distances" in results else None)
+    return merged
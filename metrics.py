@@ -0,0 +1,187 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Minimal Prometheus text-format metrics (no extra dependency). Values are per process:
+# under gunicorn each worker keeps its own counters, so scrape workers individually or
+# aggregate by the `pid` label that every sample carries.
+
+TIMING_HEADERS_ENABLED = os.getenv("TIMING_HEADERS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    labels = dict(labels, pid=os.getpid())
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []  # Callables returning extra lines at scrape time (e.g. cache stats)
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                print(f"Error collecting metrics from {collector}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name, documentation, samples, metric_type="gauge"):
+    """Formats (labels dict, value) samples as one metric family, for collectors."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+REGISTRY = Registry()
+
+QUERY_SECONDS = REGISTRY.register(Histogram(
+    "askjersey_query_seconds", "End-to-end /api/query latency by outcome.", ("endpoint", "outcome")))
+QUERY_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "askjersey_query_stage_seconds", "Latency of each /api/query pipeline stage.", ("stage",)))
+CHAT_TOKENS = REGISTRY.register(Histogram(
+    "askjersey_chat_tokens", "Tokens per chat completion, by kind (prompt/completion).", ("kind",), TOKEN_BUCKETS))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    "askjersey_query_errors_total", "/api/query failures by pipeline stage.", ("stage",)))
+CONTEXT_TOKENS = REGISTRY.register(Histogram(
+    "askjersey_context_tokens", "Prompt tokens excluding the question: the old format with the top 3 documents (baseline) vs sent (prompt).",
+    ("kind",), TOKEN_BUCKETS))
+CONTEXT_TOKENS_SAVED = REGISTRY.register(Counter(
+    "askjersey_context_tokens_saved_total", "Prompt tokens saved against the old format (baseline minus prompt)."))
+CONTEXT_ENTRIES = REGISTRY.register(Histogram(
+    "askjersey_context_entries", "FAQ entries included per prompt (the adaptive k).", (), (0, 1, 2, 3, 4, 5, 6, 8, 10)))
+RETRIEVAL_MODES = REGISTRY.register(Counter(
+    "askjersey_retrieval_total", "Questions retrieved by mode (vector, hybrid, lexical_fallback).", ("mode",)))
+EMBEDDING_FAILURES = REGISTRY.register(Counter(
+    "askjersey_query_embedding_failures_total", "Failed query-time embedding requests by reason (timeout, circuit_open, error).", ("reason",)))
+OPENAI_RETRIES = REGISTRY.register(Counter(
+    "askjersey_openai_retries_total", "OpenAI calls retried after a transient error, by operation.", ("operation",)))
+
+
+class RequestTimings:
+    """Collects per-stage durations for one request and records them in QUERY_STAGE_SECONDS."""
+
+    def __init__(self, endpoint="query"):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.details = {}         # Facts about the request for the query log (question, retrieved ids, ...)
+        self.outcome = None
+        self.error_stage = None
+        self.total_seconds = None
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        QUERY_STAGE_SECONDS.observe(seconds, stage=name)
+
+    def note(self, **details):
+        self.details.update(details)
+
+    def error(self, stage):
+        QUERY_ERRORS.inc(stage=stage)
+        self.error_stage = stage
+        self.finish("error")
+
+    def finish(self, outcome):
+        self.outcome = outcome
+        self.total_seconds = time.perf_counter() - self.started_at
+        QUERY_SECONDS.observe(self.total_seconds, endpoint=self.endpoint, outcome=outcome)
+
+    def server_timing(self):
+        """Value for a Server-Timing response header (durations in milliseconds)."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def apply_headers(self, headers):
+        """Adds the Server-Timing header when TIMING_HEADERS_ENABLED is set."""
+        if TIMING_HEADERS_ENABLED:
+            headers["Server-Timing"] = self.server_timing()
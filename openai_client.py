@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from ingestion import TRANSIENT_OPENAI_ERRORS
+from metrics import OPENAI_RETRIES
+
+# --- OpenAI client settings (override via environment variables) ---
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "3"))
+OPENAI_READ_TIMEOUT_SECONDS = float(os.getenv("OPENAI_READ_TIMEOUT_SECONDS", "30"))   # Longest wait for the next bytes, incl. between streamed tokens
+OPENAI_POOL_TIMEOUT_SECONDS = float(os.getenv("OPENAI_POOL_TIMEOUT_SECONDS", "2"))    # Longest wait for a free pooled connection
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))               # Outbound calls in flight per client
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "32"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# Deadline for a whole chat completion call including retries (streaming: until the stream opens)
+OPENAI_CHAT_DEADLINE_SECONDS = float(os.getenv("OPENAI_CHAT_DEADLINE_SECONDS", "45"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))                        # Retries per call on transient errors
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.25"))         # Seconds, doubled per attempt
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "2"))
+OPENAI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("OPENAI_BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive failures that open the circuit
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "20"))       # Fail-fast period before a probe call
+OPENAI_BUSY_RETRY_AFTER_SECONDS = 5 # Retry-After sent when OpenAI rate-limits us
+MIN_ATTEMPT_SECONDS = 0.05 # A retry is not started with less time than this left before the deadline
+
+
+def client_timeout():
+    return httpx.Timeout(OPENAI_READ_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS,
+                         pool=OPENAI_POOL_TIMEOUT_SECONDS)
+
+
+def connection_limits():
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS)
+
+
+def create_openai_client(api_key):
+    """
+    OpenAI client with a bounded keepalive connection pool and explicit timeouts. The SDK's
+    own retries are off: callers retry through call_with_retry(), under a circuit breaker.
+    """
+    return OpenAI(api_key=api_key, max_retries=0, timeout=client_timeout(),
+                  http_client=openai.DefaultHttpxClient(limits=connection_limits(), timeout=client_timeout()))
+
+
+def create_async_openai_client(api_key):
+    """Async counterpart of create_openai_client(), for asgi.py."""
+    return AsyncOpenAI(api_key=api_key, max_retries=0, timeout=client_timeout(),
+                       http_client=openai.DefaultAsyncHttpxClient(limits=connection_limits(), timeout=client_timeout()))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while a circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"OpenAI {name} circuit is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive transient failures: while open, calls
+    raise CircuitOpenError without touching the network. After `reset_seconds` a single probe
+    call is let through (half-open); its success closes the circuit, its failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=OPENAI_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds=OPENAI_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if now - self._opened_at >= self.reset_seconds else "open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the circuit is closed or this call is the half-open probe."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            retry_after = max(1.0, self.reset_seconds - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                print(f"OpenAI {self.name} circuit opened after {self._failures} consecutive failures.")
+            self._probing = False
+
+    def release_probe(self):
+        """Ends a call whose outcome is unknown (cancelled, interrupted): the next call may probe again."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {"state": self._state(time.monotonic()), "consecutive_failures": self._failures,
+                    "opened": self.opened, "rejected": self.rejected}
+
+
+# One breaker per operation, shared by the sync and async clients of a process: when embeddings
+# fail, questions can still be answered from the lexical index while chat keeps working.
+embedding_breaker = CircuitBreaker("embeddings")
+chat_breaker = CircuitBreaker("chat")
+
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter, capped at OPENAI_RETRY_MAX_DELAY."""
+    return random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _attempt_timeout(deadline):
+    """Per-attempt httpx timeout: the configured timeouts, cut down to the time left before `deadline`."""
+    remaining = max(MIN_ATTEMPT_SECONDS, deadline - time.monotonic())
+    return httpx.Timeout(min(OPENAI_READ_TIMEOUT_SECONDS, remaining),
+                         connect=min(OPENAI_CONNECT_TIMEOUT_SECONDS, remaining),
+                         pool=min(OPENAI_POOL_TIMEOUT_SECONDS, remaining))
+
+
+def _deadline(deadline_seconds):
+    return time.monotonic() + deadline_seconds if deadline_seconds and deadline_seconds > 0 else float("inf")
+
+
+def _should_retry(attempt, max_retries, delay, deadline):
+    return attempt < max_retries and time.monotonic() + delay + MIN_ATTEMPT_SECONDS < deadline
+
+
+def call_with_retry(breaker, request, deadline_seconds, max_retries=OPENAI_MAX_RETRIES):
+    """
+    Calls `request(timeout)` through `breaker`, retrying transient errors with jittered backoff
+    while retries and time before the deadline remain. Each attempt's timeout is cut to the
+    time left. Raises the last error, or CircuitOpenError while the circuit is open.
+    """
+    deadline = _deadline(deadline_seconds)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = request(_attempt_timeout(deadline))
+        except TRANSIENT_OPENAI_ERRORS:
+            breaker.record_failure()
+            delay = retry_delay(attempt)
+            if not _should_retry(attempt, max_retries, delay, deadline):
+                raise
+            OPENAI_RETRIES.inc(operation=breaker.name)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            breaker.record_success() # OpenAI answered (e.g. a 400): not an outage
+            raise
+        except BaseException:
+            breaker.release_probe() # Cancelled or interrupted: don't leave the circuit waiting on this probe
+            raise
+        breaker.record_success()
+        return result
+
+
+async def call_with_retry_async(breaker, request, deadline_seconds, max_retries=OPENAI_MAX_RETRIES):
+    """Async counterpart of call_with_retry(); `request(timeout)` returns an awaitable."""
+    deadline = _deadline(deadline_seconds)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await request(_attempt_timeout(deadline))
+        except TRANSIENT_OPENAI_ERRORS:
+            breaker.record_failure()
+            delay = retry_delay(attempt)
+            if not _should_retry(attempt, max_retries, delay, deadline):
+                raise
+            OPENAI_RETRIES.inc(operation=breaker.name)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            breaker.record_success()
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        return result
+
+
+def describe_failure(error):
+    """(HTTP status, user-facing message, Retry-After seconds or None) for a failed OpenAI call."""
+    if isinstance(error, CircuitOpenError):
+        return 503, "The AI service is temporarily unavailable. Please try again shortly.", error.retry_after
+    if isinstance(error, openai.RateLimitError):
+        return 503, "The AI service is busy. Please try again shortly.", OPENAI_BUSY_RETRY_AFTER_SECONDS
+    if isinstance(error, openai.APITimeoutError):
+        return 504, "The AI service took too long to respond. Please try again.", None
+    return 502, "Error generating AI response.", None
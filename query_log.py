@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+
+# --- Query log settings (override via environment variables) ---
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "false").lower() in ("1", "true", "yes")
+# "{pid}" is replaced by the worker's process id: each worker writes and rotates its own file
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "./logs/queries.{pid}.jsonl")
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(20 * 1024 * 1024)))  # Rotate once a file reaches this size
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))                        # Rotated files kept per worker
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))               # Records awaiting the writer; more are dropped
+FLUSH_ON_EXIT_SECONDS = 2.0
+
+
+def query_record(timings, status, cache_status):
+    """
+    Compact query log entry for one /api/query request, from the details noted on its
+    RequestTimings; None for requests that never got as far as a question.
+    """
+    details = timings.details
+    if not details.get("question"):
+        return None
+    total_seconds = timings.total_seconds if timings.total_seconds is not None else time.perf_counter() - timings.started_at
+    return {
+        "ts": round(time.time(), 3),
+        "endpoint": timings.endpoint,
+        "question": details["question"],
+        "stream": details.get("stream", False),
+        "status": status,
+        "outcome": timings.outcome or "incomplete", # No outcome: the client went away mid-stream
+        "error_stage": timings.error_stage,
+        "cache": cache_status,
+        "mode": details.get("retrieval_mode"),
+        "ids": details.get("retrieved_ids"),
+        "distances": [None if d is None else round(d, 5) for d in details["distances"]] if details.get("distances") else None,
+        "total_ms": round(total_seconds * 1000, 1),
+        "stages": {name: round(seconds * 1000, 1) for name, seconds in timings.stages.items()},
+    }
+
+
+class QueryLog:
+    """
+    Appends query records as JSON lines to a size-rotated file (RotatingFileHandler). The
+    request thread only enqueues a record; a daemon thread encodes and writes it. The writer
+    starts in the first process that records, so each gunicorn worker gets its own thread
+    and, with "{pid}" in the path, its own file. A full queue drops records rather than
+    block requests.
+    """
+
+    def __init__(self, path=QUERY_LOG_PATH, max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS,
+                 queue_size=QUERY_LOG_QUEUE_SIZE):
+        self.path_template = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = max(1, queue_size)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def path(self):
+        return self.path_template.replace("{pid}", str(os.getpid()))
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            path = self.path
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                          encoding="utf-8", delay=True)
+            self._queue = queue.Queue(maxsize=self.queue_size) # Fresh after a fork: the parent's writer thread is gone
+            self._thread = threading.Thread(target=self._write_records, args=(self._queue, handler),
+                                            name="query-log", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def record(self, entry):
+        if entry is None:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _write_records(self, records, handler):
+        while True:
+            entry = records.get()
+            if entry is None:
+                break
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            handler.handle(logging.makeLogRecord({"msg": line})) # Rotation and write errors are handled by the handler
+            self.written += 1
+        handler.close()
+
+    def close(self):
+        """Writes out queued records (waiting at most FLUSH_ON_EXIT_SECONDS) and stops the writer."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=FLUSH_ON_EXIT_SECONDS)
+        except queue.Full:
+            return
+        self._thread.join(FLUSH_ON_EXIT_SECONDS)
+
+    def stats(self):
+        return {"path": self.path, "written": self.written, "dropped": self.dropped,
+                "queued": self._queue.qsize() if self._pid == os.getpid() else 0}
@@ -0,0 +1,212 @@
+import os
+import json
+
+import numpy as np
+
+from ingestion import get_collection_version
+
+# --- Retriever settings (override via environment variables) ---
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma").lower()  # "chroma" or "numpy"
+NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", "./db_numpy")
+
+# Both backends return results in the same shape: one dict per query embedding with
+# parallel lists "ids", "documents", "metadatas" and "distances". Distances are squared
+# L2, Chroma's default space, so thresholds mean the same thing whichever backend is used.
+
+
+class ChromaRetriever:
+    """Retrieves FAQs with collection.query() against the persistent Chroma collection."""
+
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __len__(self):
+        return self.collection.count()
+
+    def query(self, query_embeddings, n_results=3, where=None):
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        per_query = []
+        for i in range(len(query_embeddings)):
+            per_query.append({
+                "ids": (results.get('ids') or [[]])[i],
+                "documents": (results.get('documents') or [[]])[i],
+                "metadatas": (results.get('metadatas') or [[]])[i],
+                "distances": (results.get('distances') or [[]])[i],
+            })
+        return per_query
+
+
+def _metadata_matches(metadata, where):
+    """Evaluates the subset of Chroma's `where` syntax we use: equality, $eq/$ne/$in/$nin, $and/$or."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_metadata_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_metadata_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op not in ("$eq", "$ne", "$in", "$nin"):
+                    raise ValueError(f"Unsupported metadata filter operator: {op}")
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyRetriever:
+    """
+    Exact nearest-neighbour search over a dense float32 matrix of unit-normalized
+    embeddings held in memory (memory-mapped from disk). For a corpus the size of
+    seed_faq.json a single matrix product beats a round trip through Chroma.
+
+    On disk the index is a directory holding `embeddings.npy` (the matrix) and
+    `records.json` (ids, documents, metadatas and the collection version it was built from).
+    """
+
+    name = "numpy"
+    MATRIX_FILE = "embeddings.npy"
+    RECORDS_FILE = "records.json"
+
+    def __init__(self, matrix, ids, documents, metadatas, version=None):
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.version = version
+        self._filter_masks = {}  # Cached boolean masks per `where` filter
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @classmethod
+    def build_from_collection(cls, collection, path=NUMPY_INDEX_PATH):
+        """Exports every embedding from a Chroma collection into an index directory and loads it."""
+        results = collection.get(include=["embeddings", "documents", "metadatas"])
+        embeddings = results.get('embeddings')
+        if embeddings is None or len(embeddings) == 0:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            matrix = cls._normalize(embeddings)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # Write to per-process temporary names then rename, so a concurrent reader never sees a
+        # half-written index and workers rebuilding at the same time don't write into each other's files
+        matrix_tmp = os.path.join(path, f"embeddings.{os.getpid()}.tmp.npy")
+        records_tmp = os.path.join(path, f"records.{os.getpid()}.tmp.json")
+        np.save(matrix_tmp, matrix)
+        with open(records_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": get_collection_version(collection),
+                "ids": results.get('ids') or [],
+                "documents": results.get('documents') or [],
+                "metadatas": results.get('metadatas') or [],
+            }, f)
+        os.replace(matrix_tmp, os.path.join(path, cls.MATRIX_FILE))
+        os.replace(records_tmp, os.path.join(path, cls.RECORDS_FILE))
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path=NUMPY_INDEX_PATH):
+        """Loads an index directory, memory-mapping the embedding matrix."""
+        with open(os.path.join(path, cls.RECORDS_FILE), 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        matrix = np.load(os.path.join(path, cls.MATRIX_FILE), mmap_mode='r')
+        return cls(matrix, records["ids"], records["documents"], records["metadatas"], records.get("version"))
+
+    @classmethod
+    def load_current(cls, collection, path=NUMPY_INDEX_PATH):
+        """Loads the index if it exists and matches the collection's current version, otherwise None."""
+        try:
+            index = cls.load(path)
+        except FileNotFoundError:
+            return None
+        if index.version == get_collection_version(collection) and len(index) == collection.count():
+            return index
+        return None
+
+    @classmethod
+    def load_or_build(cls, collection, path=NUMPY_INDEX_PATH):
+        """Loads the index if it matches the collection's current version, otherwise rebuilds it."""
+        index = cls.load_current(collection, path)
+        if index is not None:
+            return index
+        print(f"NumPy index at '{path}' is missing or stale. Building from collection '{collection.name}'...")
+        return cls.build_from_collection(collection, path)
+
+    def _filter_mask(self, where):
+        key = json.dumps(where, sort_keys=True)
+        mask = self._filter_masks.get(key)
+        if mask is None:
+            mask = np.array([_metadata_matches(m or {}, where) for m in self.metadatas], dtype=bool)
+            self._filter_masks[key] = mask
+        return mask
+
+    def query(self, query_embeddings, n_results=3, where=None):
+        if len(self) == 0 or not len(query_embeddings):
+            return [{"ids": [], "documents": [], "metadatas": [], "distances": []} for _ in query_embeddings]
+
+        queries = self._normalize(query_embeddings)
+        similarities = queries @ self.matrix.T  # (n_queries, n_docs), one matrix product for the whole batch
+
+        candidate_rows = None
+        if where:
+            mask = self._filter_mask(where)
+            candidate_rows = np.flatnonzero(mask)
+            similarities = similarities[:, candidate_rows]
+
+        k = min(n_results, similarities.shape[1])
+        per_query = []
+        for row_similarities in similarities:
+            if k == 0:
+                per_query.append({"ids": [], "documents": [], "metadatas": [], "distances": []})
+                continue
+            top = np.argpartition(-row_similarities, k - 1)[:k]
+            top = top[np.argsort(-row_similarities[top])]
+            rows = candidate_rows[top] if candidate_rows is not None else top
+            per_query.append({
+                "ids": [self.ids[r] for r in rows],
+                "documents": [self.documents[r] for r in rows],
+                "metadatas": [self.metadatas[r] for r in rows],
+                # Squared L2 between unit vectors, matching Chroma's default distance
+                "distances": [float(max(0.0, 2.0 - 2.0 * row_similarities[t])) for t in top],
+            })
+        return per_query
+
+
+def create_retriever(collection, backend=RETRIEVER_BACKEND, index_path=NUMPY_INDEX_PATH, build=True):
+    """
+    Returns the configured retriever for `collection` ("chroma" or "numpy"). With build=False a
+    missing or stale NumPy index is not rebuilt and None is returned instead.
+    """
+    if backend == "numpy":
+        if not build:
+            return NumpyRetriever.load_current(collection, index_path)
+        return NumpyRetriever.load_or_build(collection, index_path)
+    if backend != "chroma":
+        print(f"Warning: Unknown RETRIEVER_BACKEND '{backend}'. Falling back to Chroma.")
+    return ChromaRetriever(collection)
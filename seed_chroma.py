@@ -1,12 +1,22 @@
 import os
+import sys
 import json
 import chromadb
 from openai import OpenAI
 from dotenv import load_dotenv
 
-# Load environment variables (especially OPENAI_API_KEY)
+# Load environment variables (especially OPENAI_API_KEY) before importing project modules,
+# which read their settings from the environment at import time
 load_dotenv()
 
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_PATH
+from ingestion import (
+    load_faq_file, prepare_faq_records, ingest_records, sync_records, ingest_stream, file_sha256, seed_lock,
+    mark_collection_changed,
+    EMBED_BATCH_SIZE, EMBED_MAX_WORKERS, CHROMA_WRITE_CHUNK_SIZE, INGEST_STREAM_CHUNK_SIZE, PASSAGE_MAX_CHARS
+)
+from lexical_index import LexicalIndex, LEXICAL_INDEX_PATH
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY not found in .env file or environment variables. Please ensure it is set.")
@@ -19,10 +29,10 @@ except Exception as e:
     exit()
 
 # Initialize ChromaDB client (persistent)
-# This will store data in the 'db_chroma' directory
+# This will store data in the 'db_chroma' directory (or CHROMA_DB_PATH)
 try:
     # Ensure the directory for ChromaDB exists, create if not
-    db_path = "./db_chroma"
+    db_path = os.getenv("CHROMA_DB_PATH", "./db_chroma")
     if not os.path.exists(db_path):
         os.makedirs(db_path)
     client_chroma = chromadb.PersistentClient(path=db_path)
@@ -34,6 +44,13 @@ except Exception as e:
 # Define the embedding model (OpenAI's text-embedding-ada-002 is a common choice)
 EMBEDDING_MODEL = "text-embedding-ada-002" # Or "text-embedding-3-small" etc.
 
+# Persistent embedding cache (shared with app.py), so re-seeding unchanged FAQs makes no API calls
+try:
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+except Exception as e:
+    print(f"Warning: Could not open embedding cache at '{EMBEDDING_CACHE_PATH}', continuing without it: {e}")
+    embedding_cache = None
+
 # Get or create a collection (like a table in a database)
 COLLECTION_NAME = "jersey_faqs"
 print(f"Attempting to get or create ChromaDB collection: '{COLLECTION_NAME}'")
@@ -44,23 +61,10 @@ except Exception as e:
     print(f"Error with ChromaDB collection '{COLLECTION_NAME}': {e}")
     exit()
 
-def get_embedding(text_to_embed):
-    """Helper function to get embeddings from OpenAI."""
-    try:
-        response = client_openai.embeddings.create(
-            input=[text_to_embed],  # Input must be a list of strings
-            model=EMBEDDING_MODEL
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding for text: '{text_to_embed[:50]}...' - {e}")
-        return None
-
 def load_faqs_into_chroma():
     """Loads FAQs from seed_faq.json into ChromaDB."""
     try:
-        with open('seed_faq.json', 'r', encoding='utf-8') as f:
-            faqs = json.load(f)
+        faqs = load_faq_file('seed_faq.json')
     except FileNotFoundError:
         print("Error: seed_faq.json not found. Make sure it's in the project root directory.")
         return
@@ -73,72 +77,74 @@ def load_faqs_into_chroma():
 
     print(f"\nFound {len(faqs)} FAQs in seed_faq.json. Starting ingestion...")
 
-    documents_to_add = []
-    embeddings_to_add = []
-    ids_to_add = []
-    metadatas_to_add = [] 
-
-    processed_ids = set() # To track IDs already processed for this run
-
-    for faq_item in faqs:
-        faq_id = faq_item.get('id')
-        question = faq_item.get('question')
-        answer = faq_item.get('answer')
-        source = faq_item.get('source', '') 
-        category = faq_item.get('category', '') 
-
-        if not faq_id or not question or not answer:
-            print(f"Skipping FAQ due to missing id, question, or answer: {faq_item}")
-            continue
-        
-        faq_id_str = str(faq_id) # Ensure ID is a string for ChromaDB
-
-        if faq_id_str in processed_ids:
-            print(f"Warning: Duplicate FAQ ID '{faq_id_str}' found in seed_faq.json. Skipping.")
-            continue
-        processed_ids.add(faq_id_str)
-
-        text_for_embedding = f"Question: {question}\nAnswer: {answer}"
-        
-        print(f"  Processing FAQ ID: {faq_id_str} - '{question[:50]}...'")
-        embedding = get_embedding(text_for_embedding)
-
-        if embedding:
-            documents_to_add.append(text_for_embedding) 
-            embeddings_to_add.append(embedding)
-            ids_to_add.append(faq_id_str) 
-            metadatas_to_add.append({
-                "question": question,
-                "answer": answer, 
-                "source": source,
-                "category": category
-            })
-        else:
-            print(f"  Skipping FAQ ID: {faq_id_str} due to embedding error.")
-    
-    if documents_to_add:
-        try:
-            print(f"\nAttempting to add {len(documents_to_add)} documents to ChromaDB...")
-            # If IDs already exist, ChromaDB by default will skip them or you can use update/upsert.
-            # For a seeding script, 'add' is usually fine, assuming you clear the collection if re-seeding from scratch
-            # or that IDs are unique and you only want to add new ones.
-            # For simplicity, this script assumes we're adding new items or items that don't yet exist by ID.
-            # If an ID already exists, 'add' will typically ignore that specific item silently or throw an error
-            # depending on the ChromaDB version and configuration if IDs are not unique.
-            # The current behavior with unique IDs is that it should add them if they don't exist.
-            collection.add(
-                embeddings=embeddings_to_add,
-                documents=documents_to_add,
-                metadatas=metadatas_to_add,
-                ids=ids_to_add
-            )
-            print(f"Successfully processed {len(documents_to_add)} FAQs for ChromaDB collection '{COLLECTION_NAME}'.")
-            print(f"Current item count in collection: {collection.count()}")
-        except Exception as e:
-            print(f"Error adding documents to Chroma: {e}")
-            print("Please check if items with these IDs already exist or if there's another issue with the data.")
-    else:
+    records = prepare_faq_records(faqs)
+    if not records:
         print("\nNo new documents were prepared to be added to ChromaDB.")
+        return
+
+    print(f"Embedding {len(records)} FAQs in batches of {EMBED_BATCH_SIZE} "
+          f"({EMBED_MAX_WORKERS} concurrent), writing to ChromaDB in chunks of {CHROMA_WRITE_CHUNK_SIZE}...")
+    # Assumes IDs are new to the collection; clear the collection first if re-seeding from scratch.
+    report = ingest_records(collection, client_openai, records, EMBEDDING_MODEL, cache=embedding_cache)
+    if report.docs_failed:
+        print("Some documents failed; check if items with these IDs already exist or if there's another issue with the data.")
+    print(f"Current item count in collection: {collection.count()}")
+    print(report.summary())
+    if embedding_cache:
+        print(f"Embedding cache stats: {embedding_cache.stats()}")
+
+def sync_faqs_into_chroma(seed_path='seed_faq.json'):
+    """Incrementally syncs seed_faq.json into ChromaDB: only new/changed FAQs are embedded, removed ones are deleted."""
+    try:
+        faqs = load_faq_file(seed_path)
+        seed_hash = file_sha256(seed_path)
+    except FileNotFoundError:
+        print(f"Error: {seed_path} not found. Make sure it's in the project root directory.")
+        return
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode {seed_path}. Please check its JSON format.")
+        return
+    except Exception as e:
+        print(f"An unexpected error occurred opening {seed_path}: {e}")
+        return
+
+    print(f"\nFound {len(faqs)} FAQs in {seed_path}. Starting incremental sync...")
+    records = prepare_faq_records(faqs)
+    report = sync_records(collection, client_openai, records, EMBEDDING_MODEL,
+                          source_name=os.path.basename(seed_path), cache=embedding_cache, source_hash=seed_hash)
+    print(f"Current item count in collection: {collection.count()}")
+    print(report.summary())
+
+def stream_faqs_into_chroma(path, resume=True):
+    """
+    Streams a large JSON/JSONL corpus into ChromaDB in bounded chunks (see ingestion.ingest_stream),
+    checkpointing progress in the Chroma directory so an interrupted run resumes where it stopped.
+    Runs without the seed lock: it only upserts records of its own source, so app workers can
+    start (and sync the seed file) meanwhile. Returns the IngestionReport, or None on a bad file.
+    """
+    checkpoint_path = os.path.join(db_path, f".ingest-{os.path.basename(path)}.checkpoint.json")
+    print(f"\nStreaming FAQs from {path} in chunks of {INGEST_STREAM_CHUNK_SIZE} records "
+          f"(answers over {PASSAGE_MAX_CHARS} chars split into passages)...")
+    try:
+        report = ingest_stream(collection, client_openai, path, EMBEDDING_MODEL, cache=embedding_cache,
+                               checkpoint_path=checkpoint_path, resume=resume, mark_changed=False)
+    except FileNotFoundError:
+        print(f"Error: {path} not found.")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"Error: Could not decode {path} (progress up to the last checkpoint is kept): {e}")
+        return None
+    print(f"Current item count in collection: {collection.count()}")
+    print(report.summary())
+    return report
+
+def build_lexical_index():
+    """Builds the BM25 index for hybrid retrieval now, so app workers load it instead of building it."""
+    try:
+        lexical_index = LexicalIndex.load_or_build(client_chroma.get_collection(name=COLLECTION_NAME), LEXICAL_INDEX_PATH)
+        print(f"Lexical index at '{LEXICAL_INDEX_PATH}' covers {len(lexical_index)} FAQs.")
+    except Exception as e:
+        print(f"Warning: Could not build lexical index at '{LEXICAL_INDEX_PATH}': {e}")
 
 if __name__ == "__main__":
     print("Starting FAQ ingestion process for ChromaDB...")
@@ -162,7 +168,30 @@ if __name__ == "__main__":
     #         exit()
 
 
-    load_faqs_into_chroma()
+    # Default: incremental sync (upsert new/changed, delete removed). Pass --add-only for the
+    # previous behaviour of adding every FAQ with collection.add, or --stream <file.json|file.jsonl>
+    # to ingest a large corpus incrementally (add --restart to ignore its checkpoint).
+    if "--stream" in sys.argv[1:]:
+        stream_index = sys.argv.index("--stream")
+        if stream_index + 1 >= len(sys.argv):
+            print("Usage: python seed_chroma.py --stream <file.json|file.jsonl> [--restart]")
+            sys.exit(2)
+        report = stream_faqs_into_chroma(sys.argv[stream_index + 1], resume="--restart" not in sys.argv[1:])
+        # The lock is only taken for the collection metadata and the lexical index, once the stream is in
+        with seed_lock(db_path):
+            if report and report.docs_written:
+                mark_collection_changed(client_chroma.get_collection(name=COLLECTION_NAME))
+            build_lexical_index()
+    else:
+        # Hold the seed lock so app workers starting up meanwhile never sync the same collection
+        # concurrently, and re-open the collection to see metadata they may have written.
+        with seed_lock(db_path):
+            collection = client_chroma.get_collection(name=COLLECTION_NAME)
+            if "--add-only" in sys.argv[1:]:
+                load_faqs_into_chroma()
+            else:
+                sync_faqs_into_chroma()
+            build_lexical_index()
     print("\nFAQ ingestion process finished.")
 
     # Example query to test if data was loaded (optional)
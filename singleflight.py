@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from embedding_cache import normalize_text
+
+# --- Request coalescing settings (override via environment variables) ---
+QUERY_COALESCING_ENABLED = os.getenv("QUERY_COALESCING_ENABLED", "true").lower() in ("1", "true", "yes")
+# How long a follower waits for the leader's answer before running the pipeline itself
+QUERY_COALESCE_WAIT_SECONDS = float(os.getenv("QUERY_COALESCE_WAIT_SECONDS", "60"))
+# SQLite file shared by gunicorn workers on one host; empty = coalesce within each process only
+QUERY_COALESCE_STORE_PATH = os.getenv("QUERY_COALESCE_STORE_PATH", "")
+QUERY_COALESCE_POLL_SECONDS = float(os.getenv("QUERY_COALESCE_POLL_SECONDS", "0.05"))
+
+
+def coalesce_key(question):
+    """Key for identical questions: case-folded, whitespace/Unicode-normalized text."""
+    return hashlib.sha256(normalize_text(question).casefold().encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One in-flight pipeline run. The leader finishes it; followers wait for its result."""
+
+    polls_store = False # True when wait() polls the shared store (async callers run it in a thread)
+
+    def __init__(self, key):
+        self.key = key
+        self.result = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=QUERY_COALESCE_WAIT_SECONDS):
+        """Blocks until the leader finishes; returns its result, or None if it failed or timed out."""
+        self._done.wait(timeout)
+        return self.result
+
+    def _set(self, result):
+        self.result = result
+        self._done.set()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work on the same key within one process: the first caller of
+    begin() leads and must call finish(); callers arriving meanwhile follow and wait.
+    Results are JSON-serializable answer payloads; None means "no result, run it yourself".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """Returns (flight, is_leader)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, flight, result=None):
+        """Publishes the leader's result (None on failure) and wakes followers. Safe to call twice."""
+        with self._lock:
+            if flight.done():
+                return
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight._set(result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": self.in_flight()}
+
+
+class _RemoteFlight(Flight):
+    """
+    A flight led by another process. The first local caller polls the shared store for the
+    result and hands it to the local flight, so other local followers wait without polling.
+    """
+
+    polls_store = True
+
+    def __init__(self, store, local_flight):
+        super().__init__(local_flight.key)
+        self._store = store
+        self._local = local_flight
+
+    def done(self):
+        return self._local.done()
+
+    def wait(self, timeout=QUERY_COALESCE_WAIT_SECONDS):
+        result = self._store._poll_remote(self.key, timeout)
+        self._store._local.finish(self._local, result)
+        self.result = self._local.result
+        return self.result
+
+
+class SharedSingleFlight(SingleFlight):
+    """
+    SingleFlight that also coalesces across processes on one host (e.g. gunicorn workers)
+    through a small SQLite file: a leader claims the key in `inflight` and writes its result
+    to `results`, where other processes' followers pick it up. Rows older than the wait
+    timeout are treated as abandoned (a crashed leader never blocks a key for long).
+    """
+
+    def __init__(self, path=QUERY_COALESCE_STORE_PATH, wait_seconds=QUERY_COALESCE_WAIT_SECONDS,
+                 poll_seconds=QUERY_COALESCE_POLL_SECONDS):
+        super().__init__()
+        self._local = SingleFlight()
+        self.path = path
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self.remote_followers = 0
+
+        store_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        # One connection shared across threads, serialized by self._lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, pid INTEGER, started_at REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, payload TEXT, finished_at REAL)")
+
+    def _claim(self, key):
+        """Tries to become the cross-process leader for `key`. Returns True on success."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM inflight WHERE started_at < ?", (now - self.wait_seconds,))
+                self._conn.execute("DELETE FROM results WHERE finished_at < ?", (now - self.wait_seconds,))
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO inflight (key, pid, started_at) VALUES (?, ?, ?)", (key, os.getpid(), now))
+                claimed = cursor.rowcount == 1
+                if claimed:
+                    # A result left by an earlier run of this key must not be handed to this run's followers
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            return claimed
+
+    def _poll_remote(self, key, timeout):
+        """Waits for another process's result for `key`; None if its leader gave up or timed out."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                row = self._conn.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+                leading = row is None and self._conn.execute(
+                    "SELECT 1 FROM inflight WHERE key = ?", (key,)).fetchone() is not None
+            if row is not None:
+                return json.loads(row[0]) if row[0] else None
+            if not leading:
+                return None
+            time.sleep(self.poll_seconds)
+        return None
+
+    def begin(self, key):
+        flight, local_leader = self._local.begin(key)
+        if not local_leader:
+            with self._lock:
+                self.followers += 1
+            return flight, False
+        try:
+            claimed = self._claim(key)
+        except sqlite3.Error as e:
+            print(f"Error claiming query in shared coalescing store: {e}")
+            claimed = True # Store unavailable: behave like a process-local leader
+        with self._lock:
+            if claimed:
+                self.leaders += 1
+            else:
+                self.followers += 1
+                self.remote_followers += 1
+        if claimed:
+            return flight, True
+        return _RemoteFlight(self, flight), False
+
+    def finish(self, flight, result=None):
+        if flight.done():
+            return
+        try:
+            with self._lock:
+                if result is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO results (key, payload, finished_at) VALUES (?, ?, ?)",
+                        (flight.key, json.dumps(result), time.time()))
+                self._conn.execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (flight.key, os.getpid()))
+        except sqlite3.Error as e:
+            print(f"Error publishing query result to shared coalescing store: {e}")
+        self._local.finish(flight, result)
+
+    def in_flight(self):
+        return self._local.in_flight()
+
+    def stats(self):
+        return dict(super().stats(), remote_followers=self.remote_followers)
+
+
+def create_single_flight(store_path=QUERY_COALESCE_STORE_PATH):
+    """Returns a SharedSingleFlight when a store path is configured, else a process-local SingleFlight."""
+    if store_path:
+        try:
+            return SharedSingleFlight(store_path)
+        except Exception as e:
+            print(f"Warning: Could not open coalescing store at '{store_path}', coalescing within this process only: {e}")
+    return SingleFlight()
@@ -132,6 +132,54 @@ function formatTimeAgo(isoTimestamp) {
 // Removed one extra '}' that was here in your pasted code
 
 // --- Core Functionality ---
+
+/**
+ * Renders (possibly partial) answer text as escaped HTML in the answer box.
+ */
+function renderAnswer(answerText) {
+  ans.innerHTML = `<p>${escapeHtml(answerText).replace(/\n/g, '<br>')}</p>`;
+  ans.classList.remove('italic', 'loading-pulse');
+}
+
+/**
+ * Reads a server-sent event stream from /api/query, calling onUpdate with the answer
+ * so far after each token. Resolves with the full answer text.
+ */
+async function readAnswerStream(response, onUpdate) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let answerText = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line; keep any incomplete event in the buffer
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const rawEvent of events) {
+      let eventName = 'message';
+      let dataText = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+      });
+      if (!dataText) continue;
+
+      const payload = JSON.parse(dataText);
+      if (eventName === 'error') {
+        throw new Error(payload.error || 'Error generating AI response.');
+      }
+      if (eventName === 'message' && payload.token) {
+        answerText += payload.token;
+        onUpdate(answerText);
+      }
+    }
+  }
+  return answerText;
+}
 async function askQuestion() {
   const questionText = qIn.value.trim();
   if (!questionText) {
@@ -150,13 +198,14 @@ async function askQuestion() {
   ans.classList.remove('text-red-600');
 
   try {
-    // --- THIS IS THE NEW PART: Making a real API call ---
+    // Ask for a token stream (server-sent events); the server may still answer with plain JSON
     const response = await fetch('/api/query', { // Calls your Flask backend
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'Accept': 'text/event-stream, application/json',
       },
-      body: JSON.stringify({ question: questionText }),
+      body: JSON.stringify({ question: questionText, stream: true }),
     });
 
     if (!response.ok) {
@@ -171,21 +220,19 @@ async function askQuestion() {
       throw new Error(errorMsg);
     }
 
-    const data = await response.json();
-    // Ensure answer is treated as text and then potentially rendered as HTML if it's meant to be.
-    // For security, if data.answer is plain text, escape it. If it's pre-formatted HTML from a trusted source, use as is.
-    // The current backend sends plain text, so escapeHtml and then replace newlines.
-    const answerText = data.answer || "Sorry, I could not find an answer.";
-    const answerHtml = escapeHtml(answerText).replace(/\n/g, '<br>');
-    
-    ans.innerHTML = `<p>${answerHtml}</p>`; // Display the answer
-                                        // You might want to add source here too if your API returns it:
-                                        // if (data.source) {
-                                        //   ans.innerHTML += `<p class="text-xs text-gray-500 mt-2">Source: ${escapeHtml(data.source)}</p>`;
-                                        // }
-    ans.classList.remove('italic');
+    const contentType = response.headers.get('Content-Type') || '';
+    let answerText;
+    if (contentType.includes('text/event-stream') && response.body) {
+      answerText = await readAnswerStream(response, renderAnswer);
+    } else {
+      // Fallback: the original JSON contract, { answer: "..." }
+      const data = await response.json();
+      answerText = data.answer;
+    }
+
+    // The backend sends plain text, so renderAnswer escapes it and replaces newlines.
+    renderAnswer(answerText || "Sorry, I could not find an answer.");
     saveToHistory(questionText, ans.innerHTML); // Save the HTML version of the answer to history
-    // --- END OF NEW PART ---
 
   } catch(e) {
     console.error("Error asking question:", e);
@@ -0,0 +1,157 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from embedding_cache import EmbeddingCache
+from ingestion import (
+    iter_faq_file, split_passages, ingest_stream, sync_records, prepare_faq_records,
+    get_collection_version, INGEST_SOURCE_KEY, SEED_HASH_KEY,
+)
+
+
+class FakeEmbeddings:
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on # Text whose batch raises, to simulate a failed chunk
+
+    def create(self, input, model):
+        self.calls.append(list(input))
+        if self.fail_on in input:
+            raise RuntimeError("embedding failed")
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(len(text)), 1.0])
+                                     for i, text in enumerate(input)])
+
+
+class FakeCollection:
+    """The slice of a Chroma collection that ingestion uses, kept in a dict."""
+
+    name = "faqs"
+
+    def __init__(self):
+        self.records = {}
+        self.metadata = {}
+        self.fail_deletes = False
+
+    def get(self, include=None):
+        return {"ids": list(self.records), "metadatas": [r["metadata"] for r in self.records.values()]}
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        for record_id, document, metadata in zip(ids, documents, metadatas):
+            self.records[record_id] = {"document": document, "metadata": dict(metadata)}
+
+    add = upsert
+
+    def delete(self, ids):
+        if self.fail_deletes:
+            raise RuntimeError("delete failed")
+        for record_id in ids:
+            del self.records[record_id]
+
+    def modify(self, metadata):
+        self.metadata = metadata
+
+
+def _client(fail_on=None):
+    return SimpleNamespace(embeddings=FakeEmbeddings(fail_on))
+
+
+def _faqs(count, prefix="faq"):
+    return [{"id": f"{prefix}_{i}", "question": f"Question {i}?", "answer": f"Answer {i}."} for i in range(count)]
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 4, 7, 1 << 16])
+def test_json_array_items_survive_block_boundaries(tmp_path, block_size):
+    path = tmp_path / "faqs.json"
+    items = [12345678, 2, "a string, with [brackets]", {"id": 1, "answer": "x" * 20}, True, None, -0.5e3]
+    path.write_text(json.dumps(items, indent=1), encoding="utf-8")
+    assert list(iter_faq_file(str(path), block_size=block_size)) == items
+
+
+def test_jsonl_and_unterminated_array(tmp_path):
+    jsonl = tmp_path / "faqs.jsonl"
+    jsonl.write_text('{"id": 1}\n\n{"id": 2}\n', encoding="utf-8")
+    assert list(iter_faq_file(str(jsonl))) == [{"id": 1}, {"id": 2}]
+
+    broken = tmp_path / "broken.json"
+    broken.write_text('[{"id": 1}, {"id": 2}', encoding="utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_faq_file(str(broken), block_size=4))
+
+
+def test_split_passages():
+    assert split_passages("Short answer.", max_chars=100) == ["Short answer."]
+    text = " ".join(f"Sentence number {i} is here." for i in range(40))
+    passages = split_passages(text, max_chars=120, overlap=30)
+    assert len(passages) > 1
+    assert all(len(p) <= 120 for p in passages)
+    assert passages[0].startswith("Sentence number 0")
+    assert passages[-1].endswith("Sentence number 39 is here.")
+    for previous, passage in zip(passages, passages[1:]):
+        assert passage.split()[0] in previous.split() # Starts inside the previous passage, on a word
+
+
+def test_stream_resumes_from_checkpoint(tmp_path):
+    path = tmp_path / "faqs.jsonl"
+    path.write_text("\n".join(json.dumps(faq) for faq in _faqs(10)), encoding="utf-8")
+    checkpoint = str(tmp_path / "faqs.checkpoint.json")
+    collection = FakeCollection()
+
+    # Chunks of 3 items: the third chunk (faq_6..faq_8) fails, so the run stops after 6 items
+    report = ingest_stream(collection, _client(fail_on="Question: Question 7?\nAnswer: Answer 7."), str(path), "model",
+                           checkpoint_path=checkpoint, chunk_size=3)
+    assert report.docs_written == 6
+    assert sorted(collection.records) == sorted(f"faq_{i}" for i in range(6))
+    assert json.load(open(checkpoint))["items_done"] == 6
+
+    client = _client()
+    report = ingest_stream(collection, client, str(path), "model", checkpoint_path=checkpoint, chunk_size=3)
+    assert report.docs_written == 4 # Only the items after the checkpoint
+    assert sum(len(call) for call in client.embeddings.calls) == 4
+    assert len(collection.records) == 10
+    assert all(r["metadata"][INGEST_SOURCE_KEY] == "faqs.jsonl" for r in collection.records.values())
+    assert not (tmp_path / "faqs.checkpoint.json").exists()
+
+
+def test_sync_records_upserts_changes_and_deletes_removed():
+    collection = FakeCollection()
+    client = _client()
+    sync_records(collection, client, prepare_faq_records(_faqs(3)), "model", "seed.json", source_hash="h1")
+    collection.upsert(["other_1"], ["doc"], [{INGEST_SOURCE_KEY: "other.json"}], [[0.0]]) # Another file's record
+    version = get_collection_version(collection)
+    assert collection.metadata[SEED_HASH_KEY] == "h1"
+
+    faqs = _faqs(3)
+    faqs[1]["answer"] = "A changed answer."
+    del faqs[2]
+    client.embeddings.calls.clear()
+    report = sync_records(collection, client, prepare_faq_records(faqs), "model", "seed.json", source_hash="h2")
+    assert (report.docs_written, report.docs_unchanged, report.docs_deleted) == (1, 1, 1)
+    assert client.embeddings.calls == [["Question: Question 1?\nAnswer: A changed answer."]]
+    assert sorted(collection.records) == ["faq_0", "faq_1", "other_1"]
+    assert get_collection_version(collection) != version
+    assert collection.metadata[SEED_HASH_KEY] == "h2"
+
+
+def test_sync_records_keeps_hash_unset_when_deletes_fail():
+    collection = FakeCollection()
+    sync_records(collection, _client(), prepare_faq_records(_faqs(2)), "model", "seed.json", source_hash="h1")
+    collection.fail_deletes = True
+    report = sync_records(collection, _client(), prepare_faq_records(_faqs(1)), "model", "seed.json", source_hash="h2")
+    assert report.docs_failed == 1
+    assert collection.metadata[SEED_HASH_KEY] == "h1" # Retried on the next run
+
+
+def test_edited_faq_and_its_question_are_embedded_in_one_call(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    collection = FakeCollection()
+    client = _client()
+    sync_records(collection, client, prepare_faq_records(_faqs(3)), "model", "seed.json", cache=cache)
+    assert len(client.embeddings.calls) == 1 # Documents and questions share the batch
+    assert cache.get_many("model", ["Question 2?"])[0] is not None
+
+    faqs = _faqs(3)
+    faqs[2]["question"] = "Question two, reworded?"
+    client.embeddings.calls.clear()
+    sync_records(collection, client, prepare_faq_records(faqs), "model", "seed.json", cache=cache)
+    assert client.embeddings.calls == [["Question: Question two, reworded?\nAnswer: Answer 2.", "Question two, reworded?"]]
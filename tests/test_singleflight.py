@@ -0,0 +1,42 @@
+import threading
+
+from singleflight import SharedSingleFlight
+
+
+def _stores(tmp_path):
+    """Two stores on one file stand in for two worker processes."""
+    path = str(tmp_path / "coalesce.sqlite3")
+    return SharedSingleFlight(path, wait_seconds=5, poll_seconds=0.01), SharedSingleFlight(path, wait_seconds=5, poll_seconds=0.01)
+
+
+def test_remote_follower_waits_for_the_current_run(tmp_path):
+    leader_store, follower_store = _stores(tmp_path)
+    flight, leader = leader_store.begin("key")
+    assert leader
+    leader_store.finish(flight, {"answer": "R1 (old run)"})
+
+    flight, leader = leader_store.begin("key") # Second run of the same question
+    assert leader
+    remote, leader = follower_store.begin("key")
+    assert not leader
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(remote.wait(timeout=5)))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive() # Not answered with the previous run's result
+    leader_store.finish(flight, {"answer": "R2"})
+    waiter.join(5)
+    assert results == [{"answer": "R2"}]
+
+
+def test_remote_follower_gets_nothing_when_the_current_run_fails(tmp_path):
+    leader_store, follower_store = _stores(tmp_path)
+    flight, _ = leader_store.begin("key")
+    leader_store.finish(flight, {"answer": "R1 (old run)"})
+
+    flight, _ = leader_store.begin("key")
+    remote, leader = follower_store.begin("key")
+    assert not leader
+    leader_store.finish(flight, None)
+    assert remote.wait(timeout=1) is None